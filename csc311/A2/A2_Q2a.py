@@ -1,6 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from run_knn import run_knn
+from run_knn import run_knn_multi
 from logistic_regression_template import run_logistic_regression
 
 # (a)
@@ -23,19 +23,23 @@ test_data = test['test_inputs']
 test_labels = test['test_targets']
 
 
+ks = [1, 3, 5, 7, 9]
+# One neighbour search for all k, over the validation and test data at once.
+predictions = run_knn_multi(ks, train_data, train_labels,
+                            np.vstack([valid_data, test_data]))
 classification_rate_validation = []
 classification_rate_test = []
-for k in [1, 3, 5, 7, 9]:
-    vk_labels = run_knn(k, train_data, train_labels, valid_data)
-    tk_labels = run_knn(k, train_data, train_labels, test_data)
+for k in ks:
+    vk_labels = predictions[k][:len(valid_data)]
+    tk_labels = predictions[k][len(valid_data):]
     classification_rate_validation.append(np.count_nonzero(vk_labels == valid_labels) / len(valid_labels))
     classification_rate_test.append(np.count_nonzero(tk_labels == test_labels) / len(test_labels))
 
 print(classification_rate_validation)
 print(classification_rate_test)
 
-plt.scatter(np.array([1, 3, 5, 7, 9]), classification_rate_validation)
-plt.scatter(np.array([1, 3, 5, 7, 9]), classification_rate_test)
+plt.scatter(np.array(ks), classification_rate_validation)
+plt.scatter(np.array(ks), classification_rate_test)
 plt.legend(['Classification rate of validation data', 'Classification rate of test data'])
 plt.show()
 
@@ -0,0 +1,87 @@
+"""
+Activation kernels for the MLP in nn.py.
+
+Each kernel is a pair of vectorized functions registered under a name:
+
+    h, cache = forward(z, out=None)
+    grad_z = backward(grad_h, cache)
+
+The cache holds what the forward pass already computed and the backward pass
+needs (the positive mask for ReLU, the output for tanh, ...), so backprop
+never has to recompute it from z. When `out` is given, the forward kernel
+writes h into it instead of allocating a new array.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+ACTIVATIONS = {}
+
+LEAKY_RELU_SLOPE = 0.01
+_GELU_C = np.sqrt(2.0 / np.pi)
+
+
+def RegisterActivation(name, forward, backward):
+    """Adds an activation kernel to the registry.
+
+    Args:
+        name:     Name used to select the activation.
+        forward:  Function (z, out=None) -> (h, cache).
+        backward: Function (grad_h, cache) -> grad_z.
+    """
+    ACTIVATIONS[name] = (forward, backward)
+
+
+def GetActivation(name):
+    """Returns the (forward, backward) kernel pair registered under name."""
+    try:
+        return ACTIVATIONS[str(name)]
+    except KeyError:
+        raise ValueError('Unknown activation "{}", expected one of {}'.format(
+            name, sorted(ACTIVATIONS)))
+
+
+def _ReLUForward(z, out=None):
+    return np.maximum(z, 0.0, out=out), z > 0
+
+
+def _ReLUBackward(grad_h, mask):
+    return np.where(mask, grad_h, 0.0)
+
+
+def _LeakyReLUForward(z, out=None):
+    return np.maximum(z, LEAKY_RELU_SLOPE * z, out=out), z > 0
+
+
+def _LeakyReLUBackward(grad_h, mask):
+    return np.where(mask, grad_h, LEAKY_RELU_SLOPE * grad_h)
+
+
+def _TanhForward(z, out=None):
+    h = np.tanh(z, out=out)
+    return h, h
+
+
+def _TanhBackward(grad_h, h):
+    return grad_h * (1.0 - h ** 2)
+
+
+def _GELUForward(z, out=None):
+    """Tanh approximation of GELU."""
+    t = np.tanh(_GELU_C * (z + 0.044715 * z ** 3))
+    h = np.multiply(0.5 * z, 1.0 + t, out=out)
+    return h, (z, t)
+
+
+def _GELUBackward(grad_h, cache):
+    z, t = cache
+    dt_dz = (1.0 - t ** 2) * _GELU_C * (1.0 + 3 * 0.044715 * z ** 2)
+    return grad_h * (0.5 * (1.0 + t) + 0.5 * z * dt_dz)
+
+
+RegisterActivation('relu', _ReLUForward, _ReLUBackward)
+RegisterActivation('leaky_relu', _LeakyReLUForward, _LeakyReLUBackward)
+RegisterActivation('tanh', _TanhForward, _TanhBackward)
+RegisterActivation('gelu', _GELUForward, _GELUBackward)
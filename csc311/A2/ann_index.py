@@ -0,0 +1,145 @@
+"""
+Approximate nearest neighbour search with an inverted file (IVF) index.
+
+A k-means coarse quantizer splits the training data into num_lists cells.
+The index keeps the training examples sorted by cell, and a query only
+computes exact distances to the examples of its num_probe nearest cells.
+num_probe is the recall-vs-latency knob: 1 probes the fewest examples, and
+num_probe = num_lists is an exact (if slower) search.
+
+    index = IVFIndex(num_lists=64).build(train_data)
+    index.save('mnist_ivf.npz')
+    index = load_index('mnist_ivf.npz')
+    nearest, distances = index.query(valid_data, k=5, num_probe=4)
+"""
+
+import numpy as np
+
+from l2_distance import L2Distance
+from run_knn import knn_search
+
+
+class IVFIndex:
+
+    def __init__(self, num_lists=64, num_iters=20, seed=0):
+        """An empty index, see build.
+
+        Inputs:
+            num_lists: The number of k-means cells.
+            num_iters: The number of k-means iterations.
+            seed:      Random seed of the k-means initialization.
+        """
+        self.num_lists = num_lists
+        self.num_iters = num_iters
+        self.seed = seed
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+        self.data = None
+
+    def build(self, train_data):
+        """Clusters the training data and files every example in its cell.
+
+        Inputs:
+            train_data: The N_TRAIN x M array of training data.
+
+        Outputs:
+            index:      The index itself.
+        """
+        train_data = np.asarray(train_data)
+        train_data = train_data.astype(
+            np.result_type(train_data, np.float32), copy=False)
+        num_train = train_data.shape[0]
+        num_lists = min(self.num_lists, num_train)
+        rng = np.random.RandomState(self.seed)
+        centroids = train_data[rng.choice(num_train, num_lists,
+                                          replace=False)]
+        for _ in range(self.num_iters):
+            assignment = knn_search(1, centroids, train_data)[0][:, 0]
+            counts = np.bincount(assignment, minlength=num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, train_data)
+            empty = counts == 0
+            centroids = sums / np.maximum(counts, 1)[:, np.newaxis]
+            # Restart empty cells from random examples.
+            centroids[empty] = train_data[rng.choice(num_train, empty.sum())]
+        assignment = knn_search(1, centroids, train_data)[0][:, 0]
+
+        self.centroids = centroids
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignment, minlength=num_lists))])
+        self.data = train_data[self.order]
+        return self
+
+    def save(self, fname):
+        """Saves the index to a numpy file."""
+        np.savez(fname, centroids=self.centroids, order=self.order,
+                 offsets=self.offsets, data=self.data,
+                 num_iters=self.num_iters, seed=self.seed)
+
+    def query(self, queries, k, num_probe=1):
+        """Finds approximate k nearest neighbours.
+
+        Every query searches the examples of its num_probe nearest cells
+        exactly. The cells are visited one at a time, each with all the
+        queries that probe it, and the running k best of every query are
+        merged with argpartition.
+
+        Inputs:
+            queries:   The N_QUERY x M array of query data.
+            k:         The number of neighbours to find.
+            num_probe: The number of cells searched per query.
+
+        Outputs:
+            nearest:   The N_QUERY x k array of indices into the training
+                       data, nearest first. If the probed cells hold fewer
+                       than k examples, the rest is -1.
+            distances: The N_QUERY x k array of the matching Euclidean
+                       distances (inf where nearest is -1).
+        """
+        if self.centroids is None:
+            raise ValueError("The index has not been built")
+        queries = np.asarray(queries).astype(self.data.dtype, copy=False)
+        num_lists = self.centroids.shape[0]
+        num_probe = min(num_probe, num_lists)
+        num_queries = queries.shape[0]
+        probes = knn_search(num_probe, self.centroids, queries)[0]
+
+        best_dist = np.full((num_queries, k), np.inf, dtype=self.data.dtype)
+        best_idx = np.full((num_queries, k), -1, dtype=np.intp)
+        for cell in range(num_lists):
+            start, stop = self.offsets[cell], self.offsets[cell + 1]
+            rows = np.flatnonzero((probes == cell).any(axis=1))
+            if start == stop or rows.size == 0:
+                continue
+            engine = L2Distance(self.data[start:stop])
+            dist = engine.distances(queries[rows], squared=True)
+            dist = np.concatenate([best_dist[rows], dist], axis=1)
+            idx = np.concatenate(
+                [best_idx[rows],
+                 np.broadcast_to(np.arange(start, stop),
+                                 (rows.size, stop - start))], axis=1)
+            keep = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            best_dist[rows] = np.take_along_axis(dist, keep, axis=1)
+            best_idx[rows] = np.take_along_axis(idx, keep, axis=1)
+
+        order = np.argsort(best_dist, axis=1, kind='stable')
+        distances = np.sqrt(np.take_along_axis(best_dist, order, axis=1))
+        nearest = np.take_along_axis(best_idx, order, axis=1)
+        found = nearest >= 0
+        nearest[found] = self.order[nearest[found]]
+        return nearest, distances
+
+
+def load_index(fname):
+    """Loads an index saved with IVFIndex.save."""
+    npzfile = np.load(fname)
+    index = IVFIndex(num_lists=npzfile['centroids'].shape[0],
+                     num_iters=int(npzfile['num_iters']),
+                     seed=int(npzfile['seed']))
+    index.centroids = npzfile['centroids']
+    index.order = npzfile['order']
+    index.offsets = npzfile['offsets']
+    index.data = npzfile['data']
+    return index
@@ -0,0 +1,79 @@
+"""
+Benchmarks the approximate IVF index of ann_index.py against exact kNN.
+
+Both classify the MNIST test set from the training set. For every number of
+probed cells, the script reports the recall of the exact k nearest
+neighbours, the classification rate and the queries per second.
+You can run this file with the command: "python benchmark_knn.py".
+"""
+
+import time
+import numpy as np
+
+from ann_index import IVFIndex
+from run_knn import knn_search, encode_labels, vote
+
+
+def classification_rate(nearest, train_labels, test_labels):
+    """Classification rate of a majority vote over the found neighbours."""
+    classes, codes = encode_labels(train_labels.reshape(-1))
+    # Neighbours missing from an approximate search (-1) do not vote.
+    neighbour_codes = np.where(nearest >= 0, codes[nearest], 0)
+    predictions = classes[vote(neighbour_codes, len(classes),
+                               (nearest >= 0).astype(float))]
+    return np.mean(predictions == test_labels.reshape(-1))
+
+
+def recall(nearest, exact):
+    """Fraction of the exact neighbours found, averaged over the queries."""
+    hits = (nearest[:, :, np.newaxis] == exact[:, np.newaxis, :]).any(axis=1)
+    return hits.mean()
+
+
+def timed(func, *args, num_repeats=5, **kwargs):
+    """Runs func num_repeats times; returns its result and the best time."""
+    best = np.inf
+    for _ in range(num_repeats):
+        tic = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - tic)
+    return result, best
+
+
+def main():
+    """Compares exact kNN with the IVF index for a range of num_probe."""
+    k = 5
+    train = np.load("mnist_train.npz")
+    train_data = train['train_inputs']
+    train_labels = train['train_targets']
+    test = np.load("mnist_test.npz")
+    test_data = test['test_inputs']
+    test_labels = test['test_targets']
+    num_queries = test_data.shape[0]
+    num_lists = max(1, int(np.sqrt(train_data.shape[0])))
+
+    (exact, _), exact_time = timed(knn_search, k, train_data, test_data)
+    tic = time.perf_counter()
+    index = IVFIndex(num_lists=num_lists).build(train_data)
+    build_time = time.perf_counter() - tic
+    print("IVF index with {} cells built in {:.3f}s".format(num_lists,
+                                                           build_time))
+
+    print("{:12s} {:>8s} {:>10s} {:>12s}".format(
+        "Search", "Recall", "Class rate", "Queries/s"))
+    print("{:12s} {:8.3f} {:10.3f} {:12.0f}".format(
+        "exact", 1.0, classification_rate(exact, train_labels, test_labels),
+        num_queries / exact_time))
+    num_probe = 1
+    while num_probe <= num_lists:
+        (nearest, _), query_time = timed(index.query, test_data, k,
+                                         num_probe=num_probe)
+        print("{:12s} {:8.3f} {:10.3f} {:12.0f}".format(
+            "probe {}".format(num_probe), recall(nearest, exact),
+            classification_rate(nearest, train_labels, test_labels),
+            num_queries / query_time))
+        num_probe *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmarks the MLP in nn.py in double, single and mixed precision.
+
+The same network is trained for a few epochs in each mode, starting from the
+same random seed. The script reports the mean wall time of one training step
+(forward, backward and update) and the final validation accuracy.
+You can run this file with the command: "python benchmark_nn.py".
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import numpy as np
+
+from util import LoadData
+from nn import InitNN, NNForward, NNBackward, NNUpdate, \
+    SoftmaxCrossEntropy, Evaluate
+
+# (name, compute dtype, master dtype)
+MODES = [
+    ('float64', np.float64, None),
+    ('float32', np.float32, None),
+    ('mixed', np.float32, np.float64),
+]
+
+
+def BenchmarkMode(dtype, master_dtype, num_hiddens, eps, momentum, num_epochs,
+                  batch_size, seed=0):
+    """Trains one network and times its training steps.
+
+    Args:
+        dtype:        Compute dtype.
+        master_dtype: Master weight dtype, None for the compute dtype.
+        num_hiddens:  List of hidden layer sizes.
+        eps:          Learning rate.
+        momentum:     Momentum.
+        num_epochs:   Number of epochs to train for.
+        batch_size:   Mini-batch size.
+        seed:         Random seed for the initialization and the shuffling.
+
+    Returns:
+        step_time:    Mean wall time of one training step, in seconds.
+        valid_acc:    Validation accuracy after training.
+    """
+    inputs_train, inputs_valid, _, target_train, target_valid, _ = \
+        LoadData('toronto_face.npz', dtype=dtype)
+    np.random.seed(seed)
+    model = InitNN(inputs_train.shape[1], num_hiddens, target_train.shape[1],
+                   dtype=dtype, master_dtype=master_dtype)
+    num_cases = inputs_train.shape[0]
+    step_times = []
+    for epoch in range(num_epochs):
+        order = np.random.permutation(num_cases)
+        for start in range(0, num_cases, batch_size):
+            x = inputs_train[order[start: start + batch_size]]
+            t = target_train[order[start: start + batch_size]]
+            tic = time.perf_counter()
+            var = NNForward(model, x)
+            _, _, error = SoftmaxCrossEntropy(var['y'], t)
+            NNBackward(model, error, var)
+            NNUpdate(model, eps, momentum)
+            step_times.append(time.perf_counter() - tic)
+    _, valid_acc = Evaluate(inputs_valid, target_valid, model, NNForward,
+                            batch_size=batch_size)
+    return np.mean(step_times), valid_acc
+
+
+def main():
+    """Benchmarks every precision mode."""
+    num_hiddens = [16, 32]
+    eps = 0.01
+    momentum = 0.9
+    num_epochs = 20
+    batch_size = 100
+
+    print('{:10s} {:>15s} {:>10s}'.format('Mode', 'Step time (ms)',
+                                          'Valid Acc'))
+    for name, dtype, master_dtype in MODES:
+        step_time, valid_acc = BenchmarkMode(
+            dtype, master_dtype, num_hiddens, eps, momentum, num_epochs,
+            batch_size)
+        print('{:10s} {:15.3f} {:10.5f}'.format(name, step_time * 1000,
+                                                valid_acc))
+
+
+if __name__ == '__main__':
+    main()
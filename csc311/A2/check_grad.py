@@ -43,3 +43,77 @@ def check_grad(func, X, epsilon, *args):
     d = LA.norm(dh-dy)/LA.norm(dh+dy)  # return norm of diff divided by norm of sum
 
     return d
+
+
+def relative_error(a, b):
+    """
+    Returns the norm of the difference of a and b divided by the norm of
+    their sum, the accuracy measure reported by check_grad.
+    """
+    denom = LA.norm(a + b)
+    if denom == 0:
+        return LA.norm(a - b)
+    return LA.norm(a - b) / denom
+
+
+def finite_difference_batched(func_batched, X, epsilon, index=None,
+                              batch_size=32):
+    """
+    Central finite differences of a scalar function, with many perturbations
+    evaluated in one call.
+
+    For each chunk of `batch_size` elements, the perturbed copies X + epsilon
+    and X - epsilon of every element in the chunk are stacked along a new
+    leading axis and handed to func_batched at once.
+
+    Inputs:
+        func_batched: Function mapping a (P,) + X.shape stack of arguments to
+                      the P function values.
+        X:            The argument.
+        epsilon:      Size of the perturbation.
+        index:        Flat indices of the elements to differentiate, all of
+                      them by default.
+        batch_size:   Number of elements perturbed per call.
+
+    Outputs:
+        dh:           Finite difference derivatives of the indexed elements.
+    """
+    flat = np.asarray(X, dtype=float).ravel()
+    if index is None:
+        index = np.arange(flat.size)
+    index = np.asarray(index)
+    dh = np.zeros(len(index))
+    for start in range(0, len(index), batch_size):
+        chunk = index[start: start + batch_size]
+        p = len(chunk)
+        stacked = np.tile(flat, (2 * p, 1))
+        stacked[np.arange(p), chunk] += epsilon
+        stacked[p + np.arange(p), chunk] -= epsilon
+        values = func_batched(stacked.reshape((2 * p,) + np.shape(X)))
+        values = np.asarray(values).reshape(2 * p)
+        dh[start: start + p] = (values[:p] - values[p:]) / (2 * epsilon)
+    return dh
+
+
+def check_grad_batched(func, func_batched, X, epsilon, *args):
+    """
+    Same check as check_grad, but the finite differences come from
+    finite_difference_batched, so all perturbations of a chunk cost one call.
+
+    usage: check_grad_batched(func, func_batched, X, epsilon, P1, P2, ...)
+
+    where func is as in check_grad and func_batched(Xs, P1, P2, ...) returns
+    the function values for a (P, len(X), 1) stack of arguments.
+    """
+
+    if len(X.shape) != 2 or X.shape[1] != 1:
+        raise ValueError("X must be a vector")
+
+    y, dy, = func(X, *args)[:2]         # get the partial derivatives dy
+
+    dh = finite_difference_batched(lambda Xs: func_batched(Xs, *args),
+                                   X, epsilon).reshape(-1, 1)
+
+    print (np.hstack((dy, dh)))          # print the two vectors
+
+    return relative_error(dh, dy)
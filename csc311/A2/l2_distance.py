@@ -1,5 +1,8 @@
 import numpy as np
 
+# Default bytes of distance block held at a time by L2Distance.
+DEFAULT_MEMORY_BUDGET = 64 * 2**20
+
 
 def l2_distance(a, b):
     """Computes the Euclidean distance matrix between a and b.
@@ -12,4 +15,82 @@ def l2_distance(a, b):
     bb = np.sum(b**2, axis=0)
     ab = np.dot(a.T, b)
 
-    return np.sqrt(aa[:, np.newaxis] + bb[np.newaxis, :] - 2*ab)
+    # Cancellation can leave tiny negative squared distances for
+    # (near-)duplicate points; clamp them before the square root.
+    return np.sqrt(np.maximum(aa[:, np.newaxis] + bb[np.newaxis, :] - 2*ab, 0))
+
+
+class L2Distance:
+
+    def __init__(self, train_data, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """Blocked Euclidean distances from queries to a fixed training set.
+
+        The squared norms of the training examples are computed once here.
+        Queries are processed in blocks of rows sized so that one block of
+        the N_QUERY x N_TRAIN distance matrix stays within memory_budget
+        bytes, so the full matrix is never materialized.
+
+        Note: unlike l2_distance, examples are rows, as in run_knn. The
+              distances are computed in the floating point type of the
+              training data (float64 for integer data).
+
+        Inputs:
+            train_data:    The N_TRAIN x M array of training data.
+            memory_budget: Bytes of distances to hold at a time.
+        """
+        train_data = np.asarray(train_data)
+        self.train_data = train_data.astype(
+            np.result_type(train_data, np.float32), copy=False)
+        self.train_sq_norms = np.einsum('ij,ij->i', self.train_data,
+                                        self.train_data)
+        self.memory_budget = memory_budget
+
+    def block_size(self):
+        """Number of query rows per block."""
+        row_bytes = max(1, self.train_data.shape[0]) * \
+            self.train_data.dtype.itemsize
+        return max(1, int(self.memory_budget // row_bytes))
+
+    def blocks(self, queries, squared=False, block_size=None):
+        """Yields the distances from the queries to the training data.
+
+        Inputs:
+            queries:    The N_QUERY x M array of query data.
+            squared:    Yield squared distances, skipping the square root.
+                        They rank neighbours the same way.
+            block_size: Query rows per block, from the memory budget if None.
+
+        Outputs (per block):
+            start:      Index of the first query row of the block.
+            dist:       The block_size x N_TRAIN array of distances. The
+                        buffer is reused by the next block, so copy what
+                        must outlive the iteration.
+        """
+        queries = np.asarray(queries)
+        if queries.shape[1] != self.train_data.shape[1]:
+            raise ValueError("A and B should be of same dimensionality")
+        dtype = self.train_data.dtype
+        if block_size is None:
+            block_size = self.block_size()
+        num_queries = queries.shape[0]
+        buffer = np.empty((min(block_size, num_queries),
+                           self.train_data.shape[0]), dtype=dtype)
+        for start in range(0, num_queries, block_size):
+            q = queries[start:start + block_size].astype(dtype, copy=False)
+            dist = buffer[:q.shape[0]]
+            np.dot(q, self.train_data.T, out=dist)
+            dist *= -2
+            dist += self.train_sq_norms
+            dist += np.einsum('ij,ij->i', q, q)[:, np.newaxis]
+            np.maximum(dist, 0, out=dist)
+            if not squared:
+                np.sqrt(dist, out=dist)
+            yield start, dist
+
+    def distances(self, queries, squared=False):
+        """Returns the full N_QUERY x N_TRAIN distance matrix."""
+        out = np.empty((queries.shape[0], self.train_data.shape[0]),
+                       dtype=self.train_data.dtype)
+        for start, dist in self.blocks(queries, squared):
+            out[start:start + dist.shape[0]] = dist
+        return out
@@ -19,13 +19,18 @@ def logistic_predict(weights, data):
     Outputs:
         y:          :N x 1 vector of probabilities. This is the output of the classifier.
     """
-    intercept = np.ones((data.shape[0], 1))
-    x = np.append(data, intercept, axis=1)
-    log_odds = np.dot(x, weights)
-    y = sigmoid(log_odds)
+    y = sigmoid(_log_odds(weights, data))
     return y
 
 
+def _log_odds(weights, data):
+    """
+    Compute data . weights[:-1] + weights[-1], the log odds of every example,
+    without appending a column of ones (a copy of the data) for the bias.
+    """
+    return np.dot(data, weights[:-1]) + weights[-1]
+
+
 def evaluate(targets, y):
     """
     Compute evaluation metrics.
@@ -64,12 +69,17 @@ def logistic(weights, data, targets, hyperparameters):
         y:       N x 1 vector of probabilities.
     """
 
-    y = logistic_predict(weights, data)
-    intercept = np.ones((data.shape[0], 1))
-    x = np.append(data, intercept, axis=1)
-    log_odds = np.dot(x, weights)
-    f = np.sum(np.log(1+np.exp(log_odds)) - np.multiply(log_odds, targets))
-    df = np.dot(x.T, y - targets)
+    # One pass over the data: the log odds are computed once, the loss uses
+    # log(1 + exp(z)) = logaddexp(0, z), which cannot overflow, and
+    # y = sigmoid(z) = exp(z - log(1 + exp(z))) reuses it.
+    log_odds = _log_odds(weights, data)
+    softplus = np.logaddexp(0, log_odds)
+    f = np.sum(softplus - log_odds * targets)
+    y = np.exp(log_odds - softplus)
+    residual = y - targets
+    df = np.empty_like(weights, dtype=residual.dtype)
+    df[:-1] = np.dot(data.T, residual)
+    df[-1] = np.sum(residual)
     return f, df, y
 
 
@@ -95,13 +105,78 @@ def logistic_pen(weights, data, targets, hyperparameters):
     """
     lmbda = hyperparameters['weight_regularization']
 
-    y = logistic_predict(weights, data)
-    intercept = np.ones((data.shape[0], 1))
-    x = np.append(data, intercept, axis=1)
-    log_odds = np.dot(x, weights)
-    f = np.sum(np.log(1 + np.exp(log_odds)) - np.multiply(log_odds, targets)) + \
-        lmbda / 2 * np.dot(weights.T, weights)
-
-    df = np.dot(x.T, y - targets) + lmbda * weights
+    f, df, y = logistic(weights, data, targets, hyperparameters)
+    f = f + lmbda / 2 * np.dot(weights.T, weights)
+    df += lmbda * weights
 
     return f, df, y
+
+
+def logistic_hessp(weights, data, targets, hyperparameters, y, v):
+    """
+    Calculate the product of the Hessian of logistic with a vector.
+
+    The Hessian is X^T diag(y (1 - y)) X, where X is data with a column of
+    ones for the bias; it is applied to v without being formed.
+
+    Inputs:
+        weights:    (M+1) x 1 vector of weights the Hessian is taken at.
+        data:       N x M data matrix where each row corresponds 
+                    to one data point.
+        targets:    N x 1 vector of targets class probabilities.
+        hyperparameters: The hyperparameters dictionary.
+        y:          N x 1 vector of probabilities at weights, as returned
+                    by logistic.
+        v:          (M+1) x 1 vector to multiply.
+
+    Outputs:
+        hv:         (M+1) x 1 vector, the Hessian times v.
+    """
+    u = y * (1 - y) * _log_odds(v, data)
+    hv = np.empty_like(v, dtype=u.dtype)
+    hv[:-1] = np.dot(data.T, u)
+    hv[-1] = np.sum(u)
+    return hv
+
+
+def logistic_pen_hessp(weights, data, targets, hyperparameters, y, v):
+    """
+    Same as logistic_hessp, for the objective of logistic_pen.
+    """
+    lmbda = hyperparameters['weight_regularization']
+    return logistic_hessp(weights, data, targets, hyperparameters, y, v) + \
+        lmbda * v
+
+
+def logistic_batched(weights, data, targets, hyperparameters):
+    """
+    Calculate the negative log likelihood of logistic for a whole stack of
+    weight vectors at once (used for batched gradient checking).
+
+    Note: P is the number of weight vectors.
+
+    Inputs:
+        weights:    P x (M+1) x 1 stack of weight vectors, where the last
+                    element of each corresponds to bias (intercepts).
+        data:       N x M data matrix where each row corresponds 
+                    to one data point.
+        targets:    N x 1 vector of targets class probabilities.
+        hyperparameters: The hyperparameters dictionary.
+
+    Outputs:
+        f:       P vector, the objective of logistic for each weight vector.
+    """
+    log_odds = np.matmul(data, weights[:, :-1, :]) + weights[:, -1:, :]
+    return np.sum(np.logaddexp(0, log_odds) - log_odds * targets, axis=(1, 2))
+
+
+def logistic_pen_batched(weights, data, targets, hyperparameters):
+    """
+    Same as logistic_batched, for the objective of logistic_pen.
+
+    Outputs:
+        f:       P vector, the objective of logistic_pen for each weight vector.
+    """
+    lmbda = hyperparameters['weight_regularization']
+    return logistic_batched(weights, data, targets, hyperparameters) + \
+        lmbda / 2 * np.sum(weights ** 2, axis=(1, 2))
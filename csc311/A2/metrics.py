@@ -0,0 +1,177 @@
+"""
+Metrics sinks for the training loops.
+
+The training loop hands every record to its sinks as sink.log(kind, **values),
+e.g. sink.log('step', epoch=0, step=3, train_ce=1.9). Each sink decides what
+to keep: records arriving within `min_interval` seconds of the previous kept
+one are dropped unless forced, and kept records are buffered and written out
+`buffer_size` at a time. Nothing is plotted or printed on the hot path unless
+a sink asks for it.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import abc
+import csv
+import sys
+import time
+import numpy as np
+
+
+class MetricsSink(abc.ABC):
+
+    def __init__(self, min_interval=0.0, buffer_size=1):
+        """Base class of the metrics sinks.
+
+        Args:
+            min_interval: Minimum number of seconds between two kept records.
+            buffer_size:  Number of records held before they are written out.
+        """
+        self.min_interval = min_interval
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._last_time = -np.inf
+
+    def log(self, kind, force=False, **values):
+        """Offers one record to the sink.
+
+        Args:
+            kind:   Name of the record stream, e.g. 'step' or 'epoch'.
+            force:  Keep the record even if it comes too soon.
+            values: Metric values of the record.
+        """
+        now = time.perf_counter()
+        if not force and now - self._last_time < self.min_interval:
+            return
+        self._last_time = now
+        self._buffer.append((kind, values))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes out the buffered records."""
+        if self._buffer:
+            records, self._buffer = self._buffer, []
+            self.write(records)
+
+    def close(self):
+        """Flushes the sink and releases its resources."""
+        self.flush()
+
+    @abc.abstractmethod
+    def write(self, records):
+        """Writes a list of (kind, values) records. Implemented by subclasses."""
+
+
+class ConsoleSink(MetricsSink):
+
+    def __init__(self, formats=None, min_interval=0.0, buffer_size=1,
+                 stream=None):
+        """Prints records as text lines.
+
+        Args:
+            formats:      Dictionary from record kind to a format string
+                          filled with the record values. Kinds without a
+                          format are printed as key=value pairs.
+            min_interval: See MetricsSink.
+            buffer_size:  See MetricsSink.
+            stream:       File object to write to, stdout by default.
+        """
+        MetricsSink.__init__(self, min_interval, buffer_size)
+        self.formats = formats or {}
+        self.stream = stream
+
+    def write(self, records):
+        lines = []
+        for kind, values in records:
+            if kind in self.formats:
+                lines.append(self.formats[kind].format(**values))
+            else:
+                lines.append(kind + ' ' + ' '.join(
+                    '{}={}'.format(k, v) for k, v in values.items()))
+        stream = self.stream or sys.stdout
+        stream.write('\n'.join(lines) + '\n')
+
+
+class MemorySink(MetricsSink):
+
+    def __init__(self, min_interval=0.0):
+        """Keeps every record in memory, as lists of values per kind and key.
+
+        Args:
+            min_interval: See MetricsSink.
+        """
+        MetricsSink.__init__(self, min_interval)
+        self.history = {}
+
+    def write(self, records):
+        for kind, values in records:
+            columns = self.history.setdefault(kind, {})
+            for key, value in values.items():
+                columns.setdefault(key, []).append(value)
+
+    def get(self, kind, key):
+        """Returns the recorded values of one metric as an array."""
+        return np.array(self.history.get(kind, {}).get(key, []))
+
+
+class NPZSink(MemorySink):
+
+    def __init__(self, fname, min_interval=0.0):
+        """Collects records in memory and saves them to a numpy file on close.
+
+        The arrays are named '<kind>_<key>', e.g. 'epoch_valid_ce'.
+
+        Args:
+            fname:        Name of the .npz file.
+            min_interval: See MetricsSink.
+        """
+        MemorySink.__init__(self, min_interval)
+        self.fname = fname
+
+    def close(self):
+        MemorySink.close(self)
+        np.savez(self.fname, **{
+            kind + '_' + key: np.array(values)
+            for kind, columns in self.history.items()
+            for key, values in columns.items()})
+
+
+class CSVSink(MetricsSink):
+
+    def __init__(self, fname, kind, min_interval=0.0, buffer_size=100):
+        """Appends the records of one kind as rows of a CSV file.
+
+        The header is taken from the keys of the first record.
+
+        Args:
+            fname:        Name of the CSV file.
+            kind:         Record kind to write, other kinds are ignored.
+            min_interval: See MetricsSink.
+            buffer_size:  See MetricsSink.
+        """
+        MetricsSink.__init__(self, min_interval, buffer_size)
+        self.fname = fname
+        self.kind = kind
+        self._file = None
+        self._writer = None
+
+    def log(self, kind, force=False, **values):
+        if kind == self.kind:
+            MetricsSink.log(self, kind, force, **values)
+
+    def write(self, records):
+        if self._file is None:
+            self._file = open(self.fname, 'w', newline='')
+            self._writer = csv.DictWriter(self._file,
+                                          fieldnames=list(records[0][1]))
+            self._writer.writeheader()
+        self._writer.writerows(values for _, values in records)
+        self._file.flush()
+
+    def close(self):
+        MetricsSink.close(self)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,76 @@
+"""Minibatch iteration without copying the whole data set."""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def _gather(array, index, buf):
+    """Copies the rows array[index] into the front of buf and returns them."""
+    if array is None:
+        return None
+    out = buf[:len(index)]
+    np.take(array, index, axis=0, out=out, mode='clip')
+    return out
+
+
+def iterate_minibatches(inputs, targets=None, batch_size=-1, shuffle=False,
+                        prefetch=False):
+    """
+    Iterates over the rows of inputs (and targets) in minibatches.
+
+    Without shuffling the batches are slices of the inputs, so nothing is
+    copied. With shuffling only an index permutation is drawn, and each batch
+    is gathered into a buffer that is allocated once and reused.
+
+    Note: N is the number of examples.
+
+    Inputs:
+        inputs:     N x M data matrix.
+        targets:    N x K targets, or None.
+        batch_size: Number of rows per batch, -1 for the full batch.
+        shuffle:    Visit the rows in a fresh random order (np.random).
+        prefetch:   Gather the next batch in a background thread while the
+                    caller works on the current one.
+    Outputs:
+        Yields (x, t) pairs, t is None when targets is None. Shuffled batches
+        live in reused buffers: a batch is only valid until the next one is
+        requested (the one after that, with prefetch), so copy it if you
+        need to keep it.
+    """
+    num_cases = inputs.shape[0]
+    if batch_size == -1 or batch_size > num_cases:
+        batch_size = num_cases
+    starts = range(0, num_cases, batch_size)
+
+    if not shuffle:
+        for start in starts:
+            end = min(num_cases, start + batch_size)
+            yield inputs[start: end], \
+                None if targets is None else targets[start: end]
+        return
+
+    order = np.random.permutation(num_cases)
+    num_buffers = 2 if prefetch else 1
+    buffers = [
+        (np.empty((batch_size,) + inputs.shape[1:], dtype=inputs.dtype),
+         None if targets is None else
+         np.empty((batch_size,) + targets.shape[1:], dtype=targets.dtype))
+        for _ in range(num_buffers)]
+
+    def gather(step):
+        index = order[starts[step]: starts[step] + batch_size]
+        x_buf, t_buf = buffers[step % num_buffers]
+        return _gather(inputs, index, x_buf), _gather(targets, index, t_buf)
+
+    if not prefetch:
+        for step in range(len(starts)):
+            yield gather(step)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(gather, 0)
+        for step in range(len(starts)):
+            batch = pending.result()
+            if step + 1 < len(starts):
+                pending = executor.submit(gather, step + 1)
+            yield batch
@@ -12,72 +12,168 @@ After correctly fill in the code, modify the hyperparameters in "main()".
 You can then run this file with the command: "python nn.py" in your terminal.
 The program will automatically check your gradient implementation before start.
 The program will print out the training progress, and it will display the
-training curve by the end. You can optionally save the model by uncommenting
-the lines in "main()".
+training curve by the end. Train() itself never plots: it reports to metrics
+sinks (see metrics.py), so it can also run headless. You can optionally save
+the model by uncommenting the lines in "main()".
 """
 
 from __future__ import division
 from __future__ import print_function
 
 from util import LoadData, Load, Save, DisplayPlot
+from param_store import InitParamStore, PackParams, StoreGrad, ParamNames, \
+    ComputeParams, ComputeDtype, SyncParams
+from activations import GetActivation
+from minibatch import iterate_minibatches
+from metrics import ConsoleSink
+from check_grad import finite_difference_batched, relative_error
+import os
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
-
-def InitNN(num_inputs, num_hiddens, num_outputs):
+# Console lines for the records Train() reports.
+CONSOLE_FORMATS = {
+    'step': ('Epoch {epoch:3d} Step {step:2d} Train CE {train_ce:.5f} '
+             'Train Acc {train_acc:.5f}'),
+    'epoch': ('Epoch {epoch:3d} Validation CE {valid_ce:.5f} '
+              'Validation Acc {valid_acc:.5f}\n'),
+    'final': ('\nCE: Train {train_ce:.5f} Validation {valid_ce:.5f} '
+              'Test {test_ce:.5f}\n'
+              'Acc: Train {train_acc:.5f} Validation {valid_acc:.5f} '
+              'Test {test_acc:.5f}'),
+    'checkpoint': 'Epoch {epoch:3d} Checkpoint written to {fname}',
+    'profile': ('Profile {name:32s} Calls {calls:7d} Time {time:9.4f}s '
+                '{time_frac:6.1%} Alloc {bytes_per_call:11d} B/call')
+}
+
+
+def InitNN(num_inputs, num_hiddens, num_outputs, activation='relu',
+           dtype=np.float64, master_dtype=None):
     """Initializes NN parameters.
 
     Args:
         num_inputs:    Number of input units.
-        num_hiddens:   List of two elements, hidden size for each layer.
+        num_hiddens:   List of hidden sizes, one element per hidden layer.
         num_outputs:   Number of output units.
+        activation:    Name of the hidden activation (see activations.py), or
+                       a list with one name per hidden layer.
+        dtype:         Floating point type of the forward and backward pass.
+        master_dtype:  Floating point type of the weights seen by the update
+                       step, e.g. np.float64 with dtype=np.float32 for mixed
+                       precision. Defaults to dtype.
 
     Returns:
-        model:         Randomly initialized network weights.
+        model:         Randomly initialized network weights, packed into a
+                       parameter store together with zeroed velocities and
+                       gradients.
     """
-    W1 = 0.1 * np.random.randn(num_inputs, num_hiddens[0])
-    W2 = 0.1 * np.random.randn(num_hiddens[0], num_hiddens[1])
-    W3 = 0.01 * np.random.randn(num_hiddens[1], num_outputs)
-    b1 = np.zeros((num_hiddens[0]))
-    b2 = np.zeros((num_hiddens[1]))
-    b3 = np.zeros((num_outputs))
-    VW1 = np.zeros(W1.shape)
-    VW2 = np.zeros(W2.shape)
-    VW3 = np.zeros(W3.shape)
-    Vb1 = np.zeros(b1.shape)
-    Vb2 = np.zeros(b2.shape)
-    Vb3 = np.zeros(b3.shape)
-    model = {
-        'W1': W1,
-        'W2': W2,
-        'W3': W3,
-        'b1': b1,
-        'b2': b2,
-        'b3': b3,
-        'VW1': VW1,
-        'VW2': VW2,
-        'VW3': VW3,
-        'Vb1': Vb1,
-        'Vb2': Vb2,
-        'Vb3': Vb3
-    }
+    layer_sizes = [num_inputs] + list(num_hiddens) + [num_outputs]
+    num_layers = len(layer_sizes) - 1
+    model = InitParamStore(
+        [('W%d' % (i + 1), (layer_sizes[i], layer_sizes[i + 1]))
+         for i in range(num_layers)] +
+        [('b%d' % (i + 1), (layer_sizes[i + 1],))
+         for i in range(num_layers)], dtype, master_dtype)
+    for i in range(num_layers):
+        scale = 0.01 if i == num_layers - 1 else 0.1
+        model['W%d' % (i + 1)][...] = scale * np.random.randn(
+            layer_sizes[i], layer_sizes[i + 1])
+    SyncParams(model)
+    model['activation'] = activation
+    BuildGraph(model)  # Fail early on unknown or mismatched activations.
     return model
 
 
-def Affine(x, w, b):
+def BuildGraph(model):
+    """Builds the layer graph of a network.
+
+    The graph is read off the model: one affine layer per weight matrix W1..WL,
+    each hidden layer followed by its activation. It also holds the activation
+    buffers NNForward preallocates for every batch size it sees, and is cached
+    in model['_graph'] (runtime state, not saved).
+
+    Args:
+        model: Dictionary of all the weights.
+
+    Returns:
+        graph: Dictionary with
+            - layer_sizes:  [num_inputs, hidden sizes..., num_outputs].
+            - activations:  Activation name of each hidden layer.
+            - buffers:      Preallocated activations, keyed by batch size
+                            and dtype.
+    """
+    num_layers = len([k for k in ParamNames(model) if k.startswith('W')])
+    layer_sizes = [model['W1'].shape[0]] + [
+        model['W%d' % (i + 1)].shape[1] for i in range(num_layers)]
+    activations = model.get('activation', 'relu')
+    if isinstance(activations, np.ndarray):
+        activations = activations.tolist()
+    if isinstance(activations, str):
+        activations = [activations] * (num_layers - 1)
+    activations = list(activations)
+    if len(activations) != num_layers - 1:
+        raise ValueError('Expected {} hidden activations, got {}'.format(
+            num_layers - 1, len(activations)))
+    for name in activations:
+        GetActivation(name)
+
+    graph = model.get('_graph')
+    if graph is None or graph['layer_sizes'] != layer_sizes or \
+            graph['activations'] != activations:
+        graph = {
+            'layer_sizes': layer_sizes,
+            'activations': activations,
+            'buffers': {}
+        }
+        model['_graph'] = graph
+    return graph
+
+
+def _GraphBuffers(graph, batch_size, dtype):
+    """Returns the activation buffers of graph for one batch size.
+
+    One set of buffers is kept per dtype, sized to the largest batch seen so
+    far; smaller batches get views of its first rows. Memory therefore stays
+    bounded however many different batch sizes the model sees.
+    """
+    key = np.dtype(dtype)
+    buffers = graph['buffers'].get(key)
+    if buffers is None or buffers['y'].shape[0] < batch_size:
+        sizes = graph['layer_sizes']
+        buffers = {}
+        for i in range(1, len(sizes) - 1):
+            buffers['z%d' % i] = np.empty((batch_size, sizes[i]), dtype)
+            buffers['h%d' % i] = np.empty((batch_size, sizes[i]), dtype)
+        buffers['y'] = np.empty((batch_size, sizes[-1]), dtype)
+        graph['buffers'][key] = buffers
+    return {name: buf[:batch_size] for name, buf in buffers.items()}
+
+
+def _Profiled(model, name, func):
+    """Returns func, wrapped by the profiler of the model if it has one."""
+    profiler = model.get('_profiler')
+    return func if profiler is None else profiler.wrap(name, func)
+
+
+def Affine(x, w, b, out=None):
     """Computes the affine transformation.
 
     Args:
-        x: Inputs (or hidden layers)
-        w: Weights
-        b: Bias
+        x:   Inputs (or hidden layers)
+        w:   Weights
+        b:   Bias
+        out: Optional preallocated array to write the outputs into.
 
     Returns:
         y: Outputs
     """
     # y = np.dot(w.T, x) + b
-    y = x.dot(w) + b
+    if out is None:
+        y = x.dot(w) + b
+    else:
+        y = np.dot(x, w, out=out)
+        y += b
     return y
 
 
@@ -99,7 +195,7 @@ def AffineBackward(grad_y, h, w):
     # Insert your code here.
     grad_h = np.dot(grad_y, w.T)
     grad_w = np.dot(h.T, grad_y)
-    grad_b = np.dot(np.ones((1, grad_y.shape[0])), grad_y)
+    grad_b = np.dot(np.ones((1, grad_y.shape[0]), dtype=grad_y.dtype), grad_y)
     return grad_h, grad_w, grad_b
     ###########################
 
@@ -116,14 +212,22 @@ def ReLU(z):
     return np.maximum(z, 0.0)
 
 
-def ReLUBackward(grad_h, z):
+def ReLUBackward(grad_h, z, reference=False):
     """Computes gradients of the ReLU activation function wrt. the unactivated inputs.
 
+    Args:
+        grad_h:    Gradients wrt. the activations.
+        z:         Inputs of the forward pass.
+        reference: Use the element-by-element loop instead of the vectorized
+                   mask. Slow; only meant for checking the fast path.
+
     Returns:
         grad_z: Gradients wrt. the hidden state prior to activation.
     """
     ###########################
     # Insert your code here.
+    if not reference:
+        return np.where(z > 0, grad_h, 0.0)
     grad_z = np.zeros(z.shape)
     for i in range(grad_h.shape[0]):
         for j in range(grad_h.shape[1]):
@@ -143,32 +247,84 @@ def Softmax(x):
     Returns:
         y: Activation
     """
-    return np.exp(x) / np.exp(x).sum(axis=1, keepdims=True)
+    y = np.exp(x - x.max(axis=1, keepdims=True))
+    y /= y.sum(axis=1, keepdims=True)
+    return y
+
+
+def SoftmaxCrossEntropy(logits, t, with_grad=True):
+    """Computes softmax, cross entropy, accuracy and the gradient in one pass.
+
+    The logits are shifted by their row maximum, so exp never overflows and
+    the cross entropy is taken from the log-sum-exp instead of log(softmax),
+    which never hits log(0).
+
+    Args:
+        logits:    Outputs of the network before the softmax.
+        t:         Targets (one-hot rows).
+        with_grad: Also compute the gradient.
+
+    Returns:
+        ce:          Cross entropy summed over the batch.
+        num_correct: Number of rows whose arg max matches the target.
+        grad:        Gradient of the mean cross entropy wrt. the logits,
+                     (softmax(logits) - t) / N, or None without with_grad.
+    """
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    num_correct = np.count_nonzero(
+        np.argmax(shifted, axis=1) == np.argmax(t, axis=1))
+    t_dot_shifted = np.sum(t * shifted)
+    exp = np.exp(shifted, out=shifted)
+    sum_exp = exp.sum(axis=1, keepdims=True)
+    ce = np.dot(t.sum(axis=1), np.log(sum_exp[:, 0])) - t_dot_shifted
+    if not with_grad:
+        return ce, num_correct, None
+    grad = exp
+    grad /= sum_exp
+    grad -= t
+    grad /= logits.shape[0]
+    return ce, num_correct, grad
 
 
 def NNForward(model, x):
     """Runs the forward pass.
 
+    The layers are taken from the graph of the model (see BuildGraph), and
+    the intermediate variables are written into buffers that are reused by
+    the next forward pass of the model: its outputs (including 'y') are
+    overwritten by the next call, so copy what must outlive it. For the same
+    reason, a model must not run forward passes from several threads at once.
+
     Args:
-        model: Dictionary of all the weights.
+        model: Dictionary of all the weights. The hidden activations are
+               picked by model['activation'] (ReLU if missing).
         x:     Input to the network.
 
     Returns:
-        var:   Dictionary of all intermediate variables.
+        var:   Dictionary of all intermediate variables: the input 'x', the
+               pre-activations 'z1'... and activations 'h1'... of the hidden
+               layers, the output 'y' and the activation caches 'cache1'...
     """
-    z1 = Affine(x, model['W1'], model['b1'])
-    h1 = ReLU(z1)
-    z2 = Affine(h1, model['W2'], model['b2'])
-    h2 = ReLU(z2)
-    y = Affine(h2, model['W3'], model['b3'])
-    var = {
-        'x': x,
-        'z1': z1,
-        'h1': h1,
-        'z2': z2,
-        'h2': h2,
-        'y': y
-    }
+    graph = BuildGraph(model)
+    params = ComputeParams(model)
+    num_layers = len(graph['layer_sizes']) - 1
+    buffers = _GraphBuffers(
+        graph, x.shape[0], np.result_type(x, params['W1']))
+    affine = _Profiled(model, 'Affine', Affine)
+    var = {'x': x}
+    h = x
+    for i in range(1, num_layers):
+        activation = graph['activations'][i - 1]
+        forward, _ = GetActivation(activation)
+        forward = _Profiled(model, 'Activation(%s)' % activation, forward)
+        z = affine(h, params['W%d' % i], params['b%d' % i],
+                   out=buffers['z%d' % i])
+        h, cache = forward(z, out=buffers['h%d' % i])
+        var['z%d' % i] = z
+        var['h%d' % i] = h
+        var['cache%d' % i] = cache
+    var['y'] = affine(h, params['W%d' % num_layers],
+                      params['b%d' % num_layers], out=buffers['y'])
     return var
 
 
@@ -180,48 +336,54 @@ def NNBackward(model, err, var):
         err:      Gradients to the output of the network.
         var:      Intermediate variables from the forward pass.
     """
-    dE_dh2, dE_dW3, dE_db3 = AffineBackward(err, var['h2'], model['W3'])
-    dE_dz2 = ReLUBackward(dE_dh2, var['z2'])
-    dE_dh1, dE_dW2, dE_db2 = AffineBackward(dE_dz2, var['h1'], model['W2'])
-    dE_dz1 = ReLUBackward(dE_dh1, var['z1'])
-    _, dE_dW1, dE_db1 = AffineBackward(dE_dz1, var['x'], model['W1'])
-    model['dE_dW1'] = dE_dW1
-    model['dE_dW2'] = dE_dW2
-    model['dE_dW3'] = dE_dW3
-    model['dE_db1'] = dE_db1
-    model['dE_db2'] = dE_db2
-    model['dE_db3'] = dE_db3
-    pass
+    graph = BuildGraph(model)
+    params = ComputeParams(model)
+    num_layers = len(graph['layer_sizes']) - 1
+    affine_backward = _Profiled(model, 'AffineBackward', AffineBackward)
+    dE_dz = err
+    for i in range(num_layers, 0, -1):
+        h = var['h%d' % (i - 1)] if i > 1 else var['x']
+        dE_dh, dE_dW, dE_db = affine_backward(dE_dz, h, params['W%d' % i])
+        StoreGrad(model, 'W%d' % i, dE_dW)
+        StoreGrad(model, 'b%d' % i, dE_db)
+        if i > 1:
+            activation = graph['activations'][i - 2]
+            _, backward = GetActivation(activation)
+            backward = _Profiled(
+                model, 'ActivationBackward(%s)' % activation, backward)
+            dE_dz = backward(dE_dh, var['cache%d' % (i - 1)])
 
 
 def NNUpdate(model, eps, momentum):
     """Update NN weights.
 
     Args:
-        model:    Dictionary of all the weights.
+        model:    Dictionary of all the weights. Plain dictionaries (e.g. from
+                  Load) are packed into a parameter store on first use.
         eps:      Learning rate.
         momentum: Momentum.
     """
     ###########################
     # Insert your code here.
     # Update the weights.
-    model['VW1'] = momentum * model['VW1'] + (1 - momentum) * model['dE_dW1']
-    model['W1'] = model['W1'] - eps * model['VW1']
-    model['VW2'] = momentum * model['VW2'] + (1 - momentum) * model['dE_dW2']
-    model['W2'] = model['W2'] - eps * model['VW2']
-    model['VW3'] = momentum * model['VW3'] + (1 - momentum) * model['dE_dW3']
-    model['W3'] = model['W3'] - eps * model['VW3']
-    model['Vb1'] = momentum * model['Vb1'] + (1 - momentum) * model['dE_db1']
-    model['b1'] = model['b1'] - eps * model['Vb1']
-    model['Vb2'] = momentum * model['Vb2'] + (1 - momentum) * model['dE_db2']
-    model['b2'] = model['b2'] - eps * model['Vb2']
-    model['Vb3'] = momentum * model['Vb3'] + (1 - momentum) * model['dE_db3']
-    model['b3'] = model['b3'] - eps * model['Vb3']
+    # The velocities and weights of all layers sit in one contiguous store,
+    # so V = momentum * V + (1 - momentum) * dE and W = W - eps * V run in
+    # place over the whole buffer at once.
+    PackParams(model)
+    velocity = model['_velocity']
+    grads = model['_grads']
+    velocity -= grads
+    velocity *= momentum
+    velocity += grads
+    model['_params'] -= eps * velocity
+    SyncParams(model)
     ###########################
 
 
 def Train(model, forward, backward, update, eps, momentum, num_epochs,
-          batch_size):
+          batch_size, dtype=None, prefetch=False, sinks=None, data=None,
+          checkpoint_fname=None, checkpoint_every=10, resume=False,
+          patience=None, profiler=None):
     """Trains a simple MLP.
 
     Args:
@@ -233,6 +395,27 @@ def Train(model, forward, backward, update, eps, momentum, num_epochs,
         momentum:        Momentum.
         num_epochs:      Number of epochs to run training for.
         batch_size:      Mini-batch size, -1 for full batch.
+        dtype:           Floating point type to load the data in, defaults to
+                         the compute dtype of the model.
+        prefetch:        Gather the next mini-batch in a background thread.
+        sinks:           List of metrics sinks receiving 'step', 'epoch',
+                         'checkpoint' and 'final' records, defaults to
+                         printing every record. Pass [] to train silently.
+        data:            Tuple of arrays as returned by LoadData, loaded from
+                         toronto_face.npz if None.
+        checkpoint_fname: File to write checkpoints to (see SaveCheckpoint),
+                         every checkpoint_every epochs and at the end.
+        checkpoint_every: Number of epochs between two checkpoints.
+        resume:          Continue from checkpoint_fname if it exists.
+        patience:        Stop once the validation cross entropy has not
+                         improved for this many epochs, and return the
+                         weights of the best epoch. None to always run
+                         num_epochs.
+        profiler:        Optional Profiler (see profiler.py) recording the
+                         time and allocations of the layer kernels, the loss
+                         and the update step per epoch. Its flat profile is
+                         reported to the sinks as 'profile' records at the
+                         end.
 
     Returns:
         stats:           Dictionary of training statistics.
@@ -241,82 +424,205 @@ def Train(model, forward, backward, update, eps, momentum, num_epochs,
             - train_acc:      Training accuracy.
             - valid_acc:      Validation accuracy.
     """
+    if data is None:
+        if dtype is None:
+            dtype = ComputeDtype(model)
+        data = LoadData('toronto_face.npz', dtype=dtype)
     inputs_train, inputs_valid, inputs_test, target_train, target_valid, \
-        target_test = LoadData('toronto_face.npz')
-    rnd_idx = np.arange(inputs_train.shape[0])
-    train_ce_list = []
-    valid_ce_list = []
-    train_acc_list = []
-    valid_acc_list = []
-    num_train_cases = inputs_train.shape[0]
+        target_test = data
+    if sinks is None:
+        sinks = [ConsoleSink(CONSOLE_FORMATS)]
+    PackParams(model)
+    stats = {
+        'train_ce': [],
+        'valid_ce': [],
+        'train_acc': [],
+        'valid_acc': []
+    }
+    best = None
+    start_epoch = 0
+    if resume and checkpoint_fname is not None and \
+            os.path.exists(checkpoint_fname):
+        start_epoch, stats, best = RestoreCheckpoint(model, checkpoint_fname)
     if batch_size == -1:
-        batch_size = num_train_cases
-    num_steps = int(np.ceil(num_train_cases / batch_size))
-    for epoch in range(num_epochs):
-        np.random.shuffle(rnd_idx)
-        inputs_train = inputs_train[rnd_idx]
-        target_train = target_train[rnd_idx]
-        for step in range(num_steps):
-            # Forward prop.
-            start = step * batch_size
-            end = min(num_train_cases, (step + 1) * batch_size)
-            x = inputs_train[start: end]
-            t = target_train[start: end]
-
-            var = forward(model, x)
-            prediction = Softmax(var['y'])
-
-            train_ce = -np.sum(t * np.log(prediction)) / x.shape[0]
-            train_acc = (np.argmax(prediction, axis=1) ==
-                         np.argmax(t, axis=1)).astype('float').mean()
-            print(('Epoch {:3d} Step {:2d} Train CE {:.5f} '
-                   'Train Acc {:.5f}').format(
-                epoch, step, train_ce, train_acc))
-
-            # Compute error.
-            error = (prediction - t) / x.shape[0]
-
-            # Backward prop.
-            backward(model, error, var)
-
-            # Update weights.
-            update(model, eps, momentum)
-
-        valid_ce, valid_acc = Evaluate(
-            inputs_valid, target_valid, model, forward, batch_size=batch_size)
-        print(('Epoch {:3d} '
-               'Validation CE {:.5f} '
-               'Validation Acc {:.5f}\n').format(
-            epoch, valid_ce, valid_acc))
-        train_ce_list.append((epoch, train_ce))
-        train_acc_list.append((epoch, train_acc))
-        valid_ce_list.append((epoch, valid_ce))
-        valid_acc_list.append((epoch, valid_acc))
-        DisplayPlot(train_ce_list, valid_ce_list, 'Cross Entropy', number=0)
-        DisplayPlot(train_acc_list, valid_acc_list, 'Accuracy', number=1)
-
-    print()
+        batch_size = inputs_train.shape[0]
+    loss = SoftmaxCrossEntropy
+    if profiler is not None:
+        model['_profiler'] = profiler
+        loss = profiler.wrap('SoftmaxCrossEntropy', loss)
+        update = profiler.wrap('Update', update)
+        profiler.start()
+    epoch = start_epoch - 1
+    try:
+        for epoch in range(start_epoch, num_epochs):
+            batches = iterate_minibatches(inputs_train, target_train,
+                                          batch_size, shuffle=True,
+                                          prefetch=prefetch)
+            for step, (x, t) in enumerate(batches):
+                # Forward prop.
+                var = forward(model, x)
+
+                # Compute error.
+                train_ce, train_acc, error = loss(var['y'], t)
+                train_ce /= x.shape[0]
+                train_acc /= x.shape[0]
+                for sink in sinks:
+                    sink.log('step', epoch=epoch, step=step, train_ce=train_ce,
+                             train_acc=train_acc)
+
+                # Backward prop.
+                backward(model, error, var)
+
+                # Update weights.
+                update(model, eps, momentum)
+
+            valid_ce, valid_acc = Evaluate(
+                inputs_valid, target_valid, model, forward,
+                batch_size=batch_size)
+            for sink in sinks:
+                sink.log('epoch', force=True, epoch=epoch, train_ce=train_ce,
+                         train_acc=train_acc, valid_ce=valid_ce,
+                         valid_acc=valid_acc)
+            stats['train_ce'].append((epoch, train_ce))
+            stats['train_acc'].append((epoch, train_acc))
+            stats['valid_ce'].append((epoch, valid_ce))
+            stats['valid_acc'].append((epoch, valid_acc))
+            if profiler is not None:
+                profiler.end_epoch(epoch)
+
+            if patience is not None and (best is None or
+                                         valid_ce < best['valid_ce']):
+                best = {
+                    'epoch': epoch,
+                    'valid_ce': valid_ce,
+                    'params': model['_params'].copy()
+                }
+            if checkpoint_fname is not None and \
+                    (epoch + 1) % checkpoint_every == 0:
+                SaveCheckpoint(checkpoint_fname, model, epoch, stats, best)
+                for sink in sinks:
+                    sink.log('checkpoint', force=True, epoch=epoch,
+                             fname=checkpoint_fname)
+            if patience is not None and epoch - best['epoch'] >= patience:
+                for sink in sinks:
+                    sink.log('early_stop', force=True, epoch=epoch,
+                             best_epoch=best['epoch'],
+                             best_valid_ce=best['valid_ce'])
+                break
+    finally:
+        # Also on an exception (e.g. KeyboardInterrupt), so that tracing
+        # does not outlive the training run.
+        if profiler is not None:
+            profiler.stop()
+            model.pop('_profiler', None)
+    if checkpoint_fname is not None:
+        SaveCheckpoint(checkpoint_fname, model, epoch, stats, best)
+        for sink in sinks:
+            sink.log('checkpoint', force=True, epoch=epoch,
+                     fname=checkpoint_fname)
+    if best is not None:
+        model['_params'][...] = best['params']
+        SyncParams(model)
+
     train_ce, train_acc = Evaluate(
         inputs_train, target_train, model, forward, batch_size=batch_size)
     valid_ce, valid_acc = Evaluate(
         inputs_valid, target_valid, model, forward, batch_size=batch_size)
     test_ce, test_acc = Evaluate(
         inputs_test, target_test, model, forward, batch_size=batch_size)
-    print('CE: Train %.5f Validation %.5f Test %.5f' %
-          (train_ce, valid_ce, test_ce))
-    print('Acc: Train {:.5f} Validation {:.5f} Test {:.5f}'.format(
-        train_acc, valid_acc, test_acc))
-
-    stats = {
-        'train_ce': train_ce_list,
-        'valid_ce': valid_ce_list,
-        'train_acc': train_acc_list,
-        'valid_acc': valid_acc_list
-    }
+    for sink in sinks:
+        sink.log('final', force=True, train_ce=train_ce, valid_ce=valid_ce,
+                 test_ce=test_ce, train_acc=train_acc, valid_acc=valid_acc,
+                 test_acc=test_acc)
+        if profiler is not None:
+            for row in profiler.rows():
+                sink.log('profile', force=True, **row)
+        sink.flush()
 
     return model, stats
 
 
+def SaveCheckpoint(fname, model, epoch, stats, best=None):
+    """Writes everything needed to resume training to a numpy file.
+
+    The checkpoint holds the weights and velocities of the model, the last
+    finished epoch, the state of np.random, the training statistics and the
+    best snapshot for early stopping. It is written to a temporary file first
+    and then moved into place, so a killed job leaves the previous
+    checkpoint intact. It can be read back with Load or RestoreCheckpoint.
+    Nothing is printed; Train reports checkpoints to its sinks.
+
+    Args:
+        fname: Name of the .npz file.
+        model: Dictionary of network weights.
+        epoch: Last finished epoch.
+        stats: Training statistics, as returned by Train.
+        best:  Best snapshot, a dictionary with 'epoch', 'valid_ce' and the
+               flat 'params' of the parameter store, or None.
+    """
+    checkpoint = {k: v for k, v in model.items() if not k.startswith('dE_d')}
+    checkpoint['epoch'] = epoch
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    checkpoint['rng_keys'] = keys
+    checkpoint['rng_pos'] = pos
+    checkpoint['rng_has_gauss'] = has_gauss
+    checkpoint['rng_cached_gaussian'] = cached_gaussian
+    for key, values in stats.items():
+        checkpoint['stats_' + key] = np.array(values).reshape(-1, 2)
+    if best is not None:
+        checkpoint['best_epoch'] = best['epoch']
+        checkpoint['best_valid_ce'] = best['valid_ce']
+        checkpoint['best_params'] = best['params']
+    tmp_fname = fname + '.tmp.npz'
+    np.savez_compressed(tmp_fname, **{k: v for k, v in checkpoint.items()
+                                      if not k.startswith('_')})
+    os.replace(tmp_fname, fname)
+
+
+def RestoreCheckpoint(model, fname):
+    """Loads a checkpoint written by SaveCheckpoint into a model.
+
+    The weights and velocities are copied into the model in place, the
+    optimizer state ('opt_' keys, see optimizers.py) is put back and the
+    state of np.random is restored.
+
+    Args:
+        model: Dictionary of network weights with the same architecture.
+        fname: Name of the checkpoint file.
+
+    Returns:
+        epoch: The next epoch to run.
+        stats: Training statistics up to the checkpoint.
+        best:  Best snapshot for early stopping, or None.
+    """
+    checkpoint = dict(np.load(fname))
+    PackParams(model)
+    for name in ParamNames(model):
+        for key in (name, 'V' + name):
+            model[key][...] = checkpoint[key].reshape(model[key].shape)
+    SyncParams(model)
+    for key in checkpoint:
+        if key.startswith('opt_'):
+            model[key] = checkpoint[key]
+    np.random.set_state(('MT19937', checkpoint['rng_keys'],
+                         int(checkpoint['rng_pos']),
+                         int(checkpoint['rng_has_gauss']),
+                         float(checkpoint['rng_cached_gaussian'])))
+    stats = {}
+    for key in checkpoint:
+        if key.startswith('stats_'):
+            stats[key[len('stats_'):]] = [
+                (int(e), v) for e, v in checkpoint[key].tolist()]
+    best = None
+    if 'best_params' in checkpoint:
+        best = {
+            'epoch': int(checkpoint['best_epoch']),
+            'valid_ce': float(checkpoint['best_valid_ce']),
+            'params': checkpoint['best_params']
+        }
+    return int(checkpoint['epoch']) + 1, stats, best
+
+
 def Evaluate(inputs, target, model, forward, batch_size=-1):
     """Evaluates the model on inputs and target.
 
@@ -326,32 +632,94 @@ def Evaluate(inputs, target, model, forward, batch_size=-1):
         model:  Dictionary of network weights.
     """
     num_cases = inputs.shape[0]
-    if batch_size == -1:
-        batch_size = num_cases
-    num_steps = int(np.ceil(num_cases / batch_size))
     ce = 0.0
     acc = 0.0
-    for step in range(num_steps):
-        start = step * batch_size
-        end = min(num_cases, (step + 1) * batch_size)
-        x = inputs[start: end]
-        t = target[start: end]
-        prediction = Softmax(forward(model, x)['y'])
-        ce += -np.sum(t * np.log(prediction))
-        acc += (np.argmax(prediction, axis=1) == np.argmax(
-            t, axis=1)).astype('float').sum()
+    for x, t in iterate_minibatches(inputs, target, batch_size):
+        ce_step, correct_step, _ = SoftmaxCrossEntropy(
+            forward(model, x)['y'], t, with_grad=False)
+        ce += ce_step
+        acc += correct_step
     ce /= num_cases
     acc /= num_cases
     return ce, acc
 
 
-def CheckGrad(model, forward, backward, name, x):
+def NNForwardStacked(model, x, name, values):
+    """Runs the forward pass for a stack of networks differing in one tensor.
+
+    Copy p of the network uses values[p] in place of parameter `name` and
+    shares every other weight with the model. All copies run in one pass,
+    which is what the batched gradient check needs.
+
+    Args:
+        model:  Dictionary of all the weights.
+        x:      Input to the network.
+        name:   Name of the stacked parameter, e.g. 'W2'.
+        values: Array of shape (P,) + model[name].shape.
+
+    Returns:
+        y:      Outputs of the P networks, P x N x num_outputs.
+    """
+    graph = BuildGraph(model)
+    params = ComputeParams(model)
+    num_layers = len(graph['layer_sizes']) - 1
+    if name.startswith('b') and values.ndim == 2:
+        values = values[:, np.newaxis, :]
+    h = x
+    for i in range(1, num_layers + 1):
+        w = values if name == 'W%d' % i else params['W%d' % i]
+        b = values if name == 'b%d' % i else params['b%d' % i]
+        z = np.matmul(h, w) + b
+        if i == num_layers:
+            return np.broadcast_to(z, (values.shape[0],) + z.shape[-2:])
+        forward, _ = GetActivation(graph['activations'][i - 1])
+        h, _ = forward(z)
+
+
+def PredictProba(model, inputs, batch_size=-1):
+    """Computes the class probabilities of the network.
+
+    Args:
+        model:      Dictionary of network weights.
+        inputs:     N x 2304 inputs, or N x 48 x 48 images.
+        batch_size: Number of inputs per forward pass, -1 for all at once.
+
+    Returns:
+        prob:       N x num_outputs class probabilities (a new array).
+
+    Not thread-safe: the forward passes write into activation buffers shared
+    by every call on the same model (see NNForward). Call it from one thread
+    at a time per model, as InferenceServer does from its worker.
+    """
+    inputs = np.asarray(inputs, dtype=ComputeDtype(model))
+    inputs = inputs.reshape(inputs.shape[0], -1)
+    prob = np.empty((inputs.shape[0], BuildGraph(model)['layer_sizes'][-1]),
+                    dtype=inputs.dtype)
+    start = 0
+    for x, _ in iterate_minibatches(inputs, batch_size=batch_size):
+        prob[start: start + x.shape[0]] = Softmax(NNForward(model, x)['y'])
+        start += x.shape[0]
+    return prob
+
+
+def Predict(model, inputs, batch_size=-1):
+    """Predicts the class index of every input, see PredictProba."""
+    return np.argmax(PredictProba(model, inputs, batch_size), axis=1)
+
+
+def CheckGrad(model, forward, backward, name, x, num_checks=20, batched=True):
     """Check the gradients
 
     Args:
         model: Dictionary of network weights.
         name: Weights name to check.
         x: Fake input.
+        num_checks: Number of randomly chosen elements to check, -1 for all.
+        batched: Evaluate the perturbed copies in stacked forward passes
+                 (NNForwardStacked) instead of two forward calls per element.
+
+    Returns:
+        error: Relative error of the checked gradient elements.
     """
     np.random.seed(0)
     var = forward(model, x)
@@ -359,22 +727,51 @@ def CheckGrad(model, forward, backward, name, x):
     grad_y = var['y']
     backward(model, grad_y, var)
     grad_w = model['dE_d' + name].ravel()
-    w_ = model[name].ravel()
+    w_ = ComputeParams(model)[name].ravel()
     eps = 1e-7
-    grad_w_2 = np.zeros(w_.shape)
     check_elem = np.arange(w_.size)
     np.random.shuffle(check_elem)
     # Randomly check 20 elements.
-    check_elem = check_elem[:20]
-    for ii in check_elem:
-        w_[ii] += eps
-        err_plus = loss(forward(model, x)['y'])
-        w_[ii] -= 2 * eps
-        err_minus = loss(forward(model, x)['y'])
-        w_[ii] += eps
-        grad_w_2[ii] = (err_plus - err_minus) / 2 / eps
-    np.testing.assert_almost_equal(grad_w[check_elem], grad_w_2[check_elem],
-                                   decimal=3)
+    if num_checks != -1:
+        check_elem = check_elem[:num_checks]
+    if batched:
+        grad_w_2 = finite_difference_batched(
+            lambda values: 0.5 * (NNForwardStacked(
+                model, x, name, values) ** 2).sum(axis=(1, 2)),
+            ComputeParams(model)[name], eps, index=check_elem)
+    else:
+        grad_w_2 = np.zeros(len(check_elem))
+        for jj, ii in enumerate(check_elem):
+            w_[ii] += eps
+            err_plus = loss(forward(model, x)['y'])
+            w_[ii] -= 2 * eps
+            err_minus = loss(forward(model, x)['y'])
+            w_[ii] += eps
+            grad_w_2[jj] = (err_plus - err_minus) / 2 / eps
+    np.testing.assert_almost_equal(grad_w[check_elem], grad_w_2, decimal=3)
+    return relative_error(grad_w[check_elem], grad_w_2)
+
+
+def CheckGradReport(model, forward, backward, x, num_checks=20, batched=True):
+    """Checks the gradients of every parameter tensor and prints a report.
+
+    Args:
+        model: Dictionary of network weights.
+        x: Fake input.
+        num_checks: Number of elements to check per tensor, -1 for all.
+        batched: See CheckGrad.
+
+    Returns:
+        errors: Dictionary from parameter name to relative error.
+    """
+    errors = {}
+    print('{:6s} {:>14s} {:>12s}'.format('Param', 'Shape', 'Rel. error'))
+    for name in sorted(ParamNames(model), key=lambda k: (-int(k[1:]), k)):
+        errors[name] = CheckGrad(model, forward, backward, name, x,
+                                 num_checks=num_checks, batched=batched)
+        print('{:6s} {:>14s} {:12.3e}'.format(
+            name, str(model[name].shape), errors[name]))
+    return errors
 
 
 def plot_uncertain_images(x, t, prediction, threshold=0.5):
@@ -396,6 +793,7 @@ def plot_uncertain_images(x, t, prediction, threshold=0.5):
 def main():
     """Trains a NN."""
     model_fname = 'nn_model.npz'
+    checkpoint_fname = 'nn_checkpoint.npz'
     stats_fname = 'nn_stats.npz'
 
     # Hyper-parameters. Modify them if needed.
@@ -404,6 +802,7 @@ def main():
     momentum = 0.9
     num_epochs = 1000
     batch_size = 100
+    patience = 50
 
     # Input-output dimensions.
     num_inputs = 2304
@@ -413,21 +812,21 @@ def main():
     model = InitNN(num_inputs, num_hiddens, num_outputs)
 
     # Uncomment to reload trained model here.
-    # model = Load(model_fname)
+    # model = PackParams(Load(model_fname))
 
     # Check gradient implementation.
     print('Checking gradients...')
     x = np.random.rand(10, 48 * 48) * 0.1
-    CheckGrad(model, NNForward, NNBackward, 'W3', x)
-    CheckGrad(model, NNForward, NNBackward, 'b3', x)
-    CheckGrad(model, NNForward, NNBackward, 'W2', x)
-    CheckGrad(model, NNForward, NNBackward, 'b2', x)
-    CheckGrad(model, NNForward, NNBackward, 'W1', x)
-    CheckGrad(model, NNForward, NNBackward, 'b1', x)
+    CheckGradReport(model, NNForward, NNBackward, x)
 
     # Train model.
-    stats = Train(model, NNForward, NNBackward, NNUpdate, eps,
-                  momentum, num_epochs, batch_size)
+    # Set resume=True to continue from the last checkpoint. To use another
+    # optimizer, pass e.g. Adam() from optimizers.py instead of NNUpdate.
+    # Pass profiler=Profiler() from profiler.py to see where the time goes.
+    model, stats = Train(model, NNForward, NNBackward, NNUpdate, eps,
+                         momentum, num_epochs, batch_size,
+                         checkpoint_fname=checkpoint_fname, resume=False,
+                         patience=patience)
 
     # Uncomment if you wish to save the model.
     # Save(model_fname, model)
@@ -435,6 +834,11 @@ def main():
     # Uncomment if you wish to save the training statistics.
     # Save(stats_fname, stats)
 
+    # Plot the training curves.
+    DisplayPlot(stats['train_ce'], stats['valid_ce'], 'Cross Entropy', number=0)
+    DisplayPlot(stats['train_acc'], stats['valid_acc'], 'Accuracy', number=1)
+    plt.show()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,162 @@
+"""
+Optimizers for the MLP in nn.py.
+
+Every optimizer here is a factory returning a function with the signature of
+NNUpdate, update(model, eps, momentum), so it plugs straight into Train:
+
+    Train(model, NNForward, NNBackward, Adam(), 0.001, 0.9, ...)
+
+The updates run in place over the flat rows of the parameter store (see
+param_store.py). First moments live in the velocity row; any further state
+is kept in the model under 'opt_' keys, so it is saved with the model and
+restored with a checkpoint. A schedule maps the update count to a factor on
+the learning rate eps.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from param_store import PackParams, SyncParams
+
+
+def _Step(model):
+    """Counts one more update and returns the count."""
+    if 'opt_step' not in model:
+        model['opt_step'] = np.zeros((), dtype=np.int64)
+    model['opt_step'] += 1
+    return int(model['opt_step'])
+
+
+def _State(model, key):
+    """Returns a zero-initialized state buffer shaped like the parameters."""
+    if key not in model:
+        model[key] = np.zeros_like(model['_params'])
+    return model[key]
+
+
+def _Scratch(model):
+    """Returns a scratch buffer shaped like the parameters (not saved)."""
+    if '_opt_scratch' not in model:
+        model['_opt_scratch'] = np.empty_like(model['_params'])
+    return model['_opt_scratch']
+
+
+def _LearningRate(eps, schedule, step):
+    return eps if schedule is None else eps * schedule(step)
+
+
+def StepSchedule(drop=0.1, every=10000):
+    """Multiplies the learning rate by `drop` every `every` updates."""
+    return lambda step: drop ** ((step - 1) // every)
+
+
+def ExponentialSchedule(decay=0.9999):
+    """Multiplies the learning rate by `decay` after every update."""
+    return lambda step: decay ** (step - 1)
+
+
+def CosineSchedule(total_steps, min_factor=0.0, warmup_steps=0):
+    """Linear warm-up followed by a cosine decay to min_factor."""
+    def schedule(step):
+        if step <= warmup_steps:
+            return step / warmup_steps
+        progress = min(1.0, (step - warmup_steps) /
+                       max(1, total_steps - warmup_steps))
+        return min_factor + (1 - min_factor) * 0.5 * (
+            1 + np.cos(np.pi * progress))
+    return schedule
+
+
+def Momentum(schedule=None):
+    """Heavy-ball momentum, as NNUpdate, with an optional schedule.
+
+    V = momentum * V + (1 - momentum) * dE;  W = W - eps * V
+    """
+    def update(model, eps, momentum):
+        PackParams(model)
+        lr = _LearningRate(eps, schedule, _Step(model))
+        velocity = model['_velocity']
+        grads = model['_grads']
+        velocity -= grads
+        velocity *= momentum
+        velocity += grads
+        model['_params'] -= lr * velocity
+        SyncParams(model)
+    return update
+
+
+def Nesterov(schedule=None):
+    """Nesterov momentum, in the damped form of Momentum.
+
+    V = momentum * V + (1 - momentum) * dE
+    W = W - eps * (momentum * V + (1 - momentum) * dE)
+    """
+    def update(model, eps, momentum):
+        PackParams(model)
+        lr = _LearningRate(eps, schedule, _Step(model))
+        params = model['_params']
+        velocity = model['_velocity']
+        grads = model['_grads']
+        velocity -= grads
+        velocity *= momentum
+        velocity += grads
+        scratch = np.multiply(velocity, lr * momentum, out=_Scratch(model))
+        params -= scratch
+        np.multiply(grads, lr * (1 - momentum), out=scratch)
+        params -= scratch
+        SyncParams(model)
+    return update
+
+
+def RMSProp(decay=0.9, epsilon=1e-8, schedule=None):
+    """RMSProp. The `momentum` argument of the update is ignored.
+
+    S = decay * S + (1 - decay) * dE^2;  W = W - eps * dE / (sqrt(S) + epsilon)
+    """
+    def update(model, eps, momentum):
+        PackParams(model)
+        lr = _LearningRate(eps, schedule, _Step(model))
+        grads = model['_grads']
+        mean_square = _State(model, 'opt_mean_square')
+        scratch = np.multiply(grads, grads, out=_Scratch(model))
+        mean_square *= decay
+        scratch *= 1 - decay
+        mean_square += scratch
+        np.sqrt(mean_square, out=scratch)
+        scratch += epsilon
+        np.divide(grads, scratch, out=scratch)
+        scratch *= lr
+        model['_params'] -= scratch
+        SyncParams(model)
+    return update
+
+
+def Adam(beta1=0.9, beta2=0.999, epsilon=1e-8, schedule=None):
+    """Adam, with the first moment kept in the velocity row.
+
+    The `momentum` argument of the update is ignored in favour of beta1.
+    """
+    def update(model, eps, momentum):
+        PackParams(model)
+        step = _Step(model)
+        lr = _LearningRate(eps, schedule, step)
+        lr *= np.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+        grads = model['_grads']
+        first = model['_velocity']
+        second = _State(model, 'opt_second_moment')
+        first -= grads
+        first *= beta1
+        first += grads
+        scratch = np.multiply(grads, grads, out=_Scratch(model))
+        second *= beta2
+        scratch *= 1 - beta2
+        second += scratch
+        np.sqrt(second, out=scratch)
+        scratch += epsilon
+        np.divide(first, scratch, out=scratch)
+        scratch *= lr
+        model['_params'] -= scratch
+        SyncParams(model)
+    return update
@@ -0,0 +1,152 @@
+"""
+Contiguous parameter store for the MLP in nn.py.
+
+All weights, their momentum velocities and their gradients live in one float
+buffer of shape (3, total): row 0 holds the parameters, row 1 the velocities
+and row 2 the gradients. The model dictionary keeps named views into that
+buffer ('W1', 'VW1', 'dE_dW1', ...), so the update step can run in place over
+every parameter with a handful of vectorized operations.
+
+For mixed precision the store keeps the master copy in a wide dtype (for
+the momentum update) and a second flat buffer of compute-dtype parameters
+that the forward and backward passes read through ComputeParams. SyncParams
+refreshes the compute copy after each update.
+
+Entries whose key starts with an underscore are runtime state (the buffer and
+its flat rows) and are not written out by util.Save.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import re
+import numpy as np
+
+PARAMS = 0
+VELOCITY = 1
+GRADS = 2
+
+_PARAM_NAME = re.compile(r'^([Wb])(\d+)$')
+
+
+def ParamNames(model):
+    """Returns the parameter names in model in packing order.
+
+    Weights come first, then biases, each ordered by layer index, i.e.
+    ['W1', 'W2', ..., 'b1', 'b2', ...].
+    """
+    names = [k for k in model if _PARAM_NAME.match(k)]
+    return sorted(names, key=lambda k: (k[0] != 'W', int(k[1:])))
+
+
+def InitParamStore(shapes, dtype=np.float64, master_dtype=None):
+    """Allocates a zero-filled parameter store.
+
+    Args:
+        shapes:       List of (name, shape) pairs, in packing order.
+        dtype:        Floating point type the network computes in.
+        master_dtype: Floating point type of the master weights, velocities
+                      and gradients. Defaults to dtype; when it differs, a
+                      separate compute copy of the weights is kept.
+
+    Returns:
+        model:  Dictionary of named views into the buffer. For each parameter
+                `name` it holds `name`, its velocity `'V' + name` and its
+                gradient `'dE_d' + name`. The flat rows are kept under
+                '_params', '_velocity' and '_grads'.
+    """
+    if master_dtype is None:
+        master_dtype = dtype
+    sizes = [int(np.prod(shape)) for _, shape in shapes]
+    store = np.zeros((3, sum(sizes)), dtype=master_dtype)
+    model = {
+        '_store': store,
+        '_params': store[PARAMS],
+        '_velocity': store[VELOCITY],
+        '_grads': store[GRADS]
+    }
+    mixed = np.dtype(dtype) != np.dtype(master_dtype)
+    if mixed:
+        model['_compute'] = np.zeros(sum(sizes), dtype=dtype)
+        model['_compute_views'] = {}
+    offset = 0
+    for (name, shape), size in zip(shapes, sizes):
+        window = slice(offset, offset + size)
+        model[name] = store[PARAMS, window].reshape(shape)
+        model['V' + name] = store[VELOCITY, window].reshape(shape)
+        model['dE_d' + name] = store[GRADS, window].reshape(shape)
+        if mixed:
+            model['_compute_views'][name] = \
+                model['_compute'][window].reshape(shape)
+        offset += size
+    return model
+
+
+def IsPacked(model):
+    """Returns True if the model is backed by a parameter store."""
+    return '_store' in model
+
+
+def PackParams(model, dtype=None, master_dtype=None):
+    """Moves the parameters of a plain model dictionary into a store.
+
+    The dictionary is updated in place, so a model returned by util.Load can
+    be handed straight to NNUpdate. Velocities and gradients are copied over
+    when present and zero-filled otherwise. Packing an already packed model
+    is a no-op.
+
+    Args:
+        model:        Dictionary of network weights.
+        dtype:        Compute dtype, defaults to the dtype of the weights.
+        master_dtype: Master dtype, see InitParamStore.
+
+    Returns:
+        model: The same dictionary, now backed by a parameter store.
+    """
+    if IsPacked(model):
+        return model
+    names = ParamNames(model)
+    if dtype is None:
+        dtype = np.result_type(np.float32, *[model[k] for k in names])
+    store = InitParamStore([(k, np.shape(model[k])) for k in names],
+                           dtype, master_dtype)
+    for name in names:
+        for key in (name, 'V' + name, 'dE_d' + name):
+            if key in model:
+                store[key][...] = np.reshape(model[key], store[key].shape)
+    model.update(store)
+    SyncParams(model)
+    return model
+
+
+def ComputeParams(model):
+    """Returns the weights the forward and backward passes should read.
+
+    This is the model itself, except in mixed precision where it is the
+    dictionary of compute-dtype views.
+    """
+    return model.get('_compute_views', model)
+
+
+def ComputeDtype(model):
+    """Returns the dtype the network computes in."""
+    return ComputeParams(model)['W1'].dtype
+
+
+def SyncParams(model):
+    """Copies the master weights into the compute copy, if there is one."""
+    if '_compute' in model:
+        np.copyto(model['_compute'], model['_params'], casting='same_kind')
+
+
+def StoreGrad(model, name, grad):
+    """Writes the gradient of parameter `name` into the model.
+
+    Packed models receive the values in place so the gradient row of the
+    store stays valid; plain dictionaries just get the array assigned.
+    """
+    key = 'dE_d' + name
+    if IsPacked(model):
+        model[key][...] = np.reshape(grad, model[key].shape)
+    else:
+        model[key] = grad
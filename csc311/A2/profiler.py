@@ -0,0 +1,117 @@
+"""
+Opt-in profiling of the layer kernels of the MLP in nn.py.
+
+A Profiler wraps functions so that every call records its wall time and the
+bytes it allocated (the peak of the memory traced by tracemalloc during the
+call, which counts NumPy arrays too). Totals are aggregated per epoch:
+
+    profiler = Profiler()
+    Train(model, NNForward, NNBackward, NNUpdate, ..., profiler=profiler)
+    profiler.rows()    # one row per kernel, summed over all epochs
+
+Without a profiler nothing is wrapped and the kernels run at full speed.
+Tracing memory slows down every allocation, so pass trace_memory=False to
+measure time alone.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import tracemalloc
+
+
+class Profiler:
+
+    def __init__(self, trace_memory=True):
+        """Records the calls of wrapped functions.
+
+        Args:
+            trace_memory: Also measure allocated bytes with tracemalloc.
+        """
+        self.trace_memory = trace_memory
+        self.epochs = []
+        self._current = {}
+        self._wrapped = {}
+        self._started_tracing = False
+
+    def start(self):
+        """Starts tracing memory, if enabled and not traced already."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """Stops tracing memory if start() began it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def wrap(self, name, func):
+        """Returns func recording its calls under name.
+
+        The wrapped functions must not call each other: the allocation peak
+        is reset at the start of every call.
+        """
+        key = (name, func)
+        if key not in self._wrapped:
+            def profiled(*args, **kwargs):
+                tracing = tracemalloc.is_tracing()
+                if tracing:
+                    tracemalloc.reset_peak()
+                    start_bytes = tracemalloc.get_traced_memory()[0]
+                tic = time.perf_counter()
+                result = func(*args, **kwargs)
+                elapsed = time.perf_counter() - tic
+                allocated = 0
+                if tracing:
+                    allocated = tracemalloc.get_traced_memory()[1] - start_bytes
+                self.record(name, elapsed, allocated)
+                return result
+            self._wrapped[key] = profiled
+        return self._wrapped[key]
+
+    def record(self, name, elapsed, allocated=0):
+        """Adds one call of name to the current epoch."""
+        totals = self._current.setdefault(name, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] += allocated
+
+    def end_epoch(self, epoch):
+        """Closes the totals of the current epoch."""
+        self.epochs.append((epoch, self._current))
+        self._current = {}
+
+    def rows(self, epoch=None):
+        """Returns the flat profile, one row per function.
+
+        Args:
+            epoch: Only this epoch, or None to sum over all epochs.
+
+        Returns:
+            rows:  Dictionaries with the name, number of calls, total time in
+                   seconds, fraction of the profiled time, and total and
+                   per-call allocated bytes, sorted by decreasing time.
+        """
+        totals = {}
+        for e, current in self.epochs + [(None, self._current)]:
+            if epoch is not None and e != epoch:
+                continue
+            for name, (calls, elapsed, allocated) in current.items():
+                total = totals.setdefault(name, [0, 0.0, 0])
+                total[0] += calls
+                total[1] += elapsed
+                total[2] += allocated
+        total_time = sum(t[1] for t in totals.values()) or 1.0
+        rows = [{
+            'name': name,
+            'calls': calls,
+            'time': elapsed,
+            'time_frac': elapsed / total_time,
+            'time_per_call': elapsed / calls,
+            'bytes': allocated,
+            'bytes_per_call': allocated // calls
+        } for name, (calls, elapsed, allocated) in totals.items()]
+        rows.sort(key=lambda row: -row['time'])
+        return rows
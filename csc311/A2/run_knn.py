@@ -1,8 +1,180 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from l2_distance import l2_distance
+from l2_distance import L2Distance
 
+# Distances below this count as this in distance-weighted voting, so an exact
+# match gets a large but finite weight.
+MIN_VOTE_DISTANCE = 1e-12
 
-def run_knn(k, train_data, train_labels, valid_data):
+# Fewest rows per shard of map_shards. Below this the cost of the threads
+# outweighs the parallel work.
+MIN_SHARD_ROWS = 256
+
+
+def num_shards(num_rows, num_threads=None, min_rows=MIN_SHARD_ROWS):
+    """The number of threads map_shards uses for num_rows rows.
+
+    Inputs:
+        num_rows:    The total number of rows.
+        num_threads: The largest number of threads, os.cpu_count() if None.
+        min_rows:    The fewest rows per shard.
+
+    Outputs:
+        num_threads: num_threads, reduced so that every shard has at least
+                     min_rows rows; at least 1.
+    """
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    return max(1, min(num_threads, num_rows // max(1, min_rows)))
+
+
+def map_shards(func, num_rows, num_threads=None, min_rows=MIN_SHARD_ROWS):
+    """Runs func over contiguous shards of rows in a thread pool.
+
+    func(start, stop) handles rows start ... stop - 1 and writes its results
+    into arrays shared by all shards at those rows, so the merged output is
+    in the original order. NumPy releases the GIL inside BLAS and most
+    array operations, so the shards run in parallel.
+
+    Inputs:
+        func:        Function (start, stop) -> None.
+        num_rows:    The total number of rows.
+        num_threads: The largest number of threads, see num_shards. With
+                     one thread, func runs once over all rows in the caller.
+        min_rows:    The fewest rows per shard, see num_shards.
+    """
+    num_threads = num_shards(num_rows, num_threads, min_rows)
+    if num_threads == 1:
+        func(0, num_rows)
+        return
+    bounds = np.linspace(0, num_rows, num_threads + 1).astype(int)
+    with ThreadPoolExecutor(num_threads) as executor:
+        futures = [executor.submit(func, start, stop)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        for future in futures:
+            future.result()
+
+
+def knn_search(k, train_data, valid_data, engine=None, num_threads=None):
+    """Finds the k nearest training examples of every validation example.
+
+    The distances are computed block by block (see L2Distance), and each
+    block only partially sorts its rows: argpartition picks the k smallest
+    squared distances in linear time, and only those k are sorted. The
+    square root is taken of the selected distances alone. The blocks are
+    sized so that the distances and the index array of argpartition
+    together stay within the memory budget of the engine.
+
+    Inputs:
+        k:            The number of neighbours to find.
+        train_data:   The N_TRAIN x M array of training data.
+        valid_data:   The N_VALID x M array of data to find neighbours for.
+        engine:       Optional L2Distance over train_data, to reuse its
+                      cached norms across calls.
+        num_threads:  The largest number of threads searching shards of
+                      valid_data (see map_shards). Every shard has at least
+                      one full-budget block of rows or MIN_SHARD_ROWS rows,
+                      so small query sets are searched in a single call.
+                      The memory budget of the engine is shared between the
+                      threads.
+
+    Outputs:
+        nearest:      The N_VALID x k array of indices into train_data,
+                      nearest first.
+        distances:    The N_VALID x k array of the matching Euclidean
+                      distances.
+    """
+    if engine is None:
+        engine = L2Distance(train_data)
+    num_train = engine.train_data.shape[0]
+    if not 1 <= k <= num_train:
+        raise ValueError("k should be between 1 and the number of training "
+                         "examples ({}), got {}".format(num_train, k))
+    num_valid = valid_data.shape[0]
+    nearest = np.empty((num_valid, k), dtype=np.intp)
+    distances = np.empty((num_valid, k), dtype=engine.train_data.dtype)
+    row_bytes = max(1, num_train) * (engine.train_data.dtype.itemsize +
+                                     np.dtype(np.intp).itemsize)
+    block_size = max(1, int(engine.memory_budget // row_bytes))
+    min_rows = max(MIN_SHARD_ROWS, block_size)
+    num_threads = num_shards(num_valid, num_threads, min_rows)
+    block_size = max(1, block_size // num_threads)
+
+    def search_shard(shard_start, shard_stop):
+        for start, dist in engine.blocks(valid_data[shard_start:shard_stop],
+                                         squared=True, block_size=block_size):
+            if k < num_train:
+                # Copied, so that the block-sized index array is freed
+                # before the next block.
+                idx = np.argpartition(dist, k - 1, axis=1)[:, :k].copy()
+            else:
+                idx = np.broadcast_to(np.arange(num_train), dist.shape)
+            d = np.take_along_axis(dist, idx, axis=1)
+            order = np.argsort(d, axis=1, kind='stable')
+            start += shard_start
+            stop = start + dist.shape[0]
+            nearest[start:stop] = np.take_along_axis(idx, order, axis=1)
+            distances[start:stop] = np.sqrt(
+                np.take_along_axis(d, order, axis=1))
+
+    map_shards(search_shard, num_valid, num_threads, min_rows)
+    return nearest, distances
+
+
+def encode_labels(labels):
+    """Maps arbitrary class labels to the codes 0 ... C - 1.
+
+    Inputs:
+        labels:  Array of class labels.
+
+    Outputs:
+        classes: The C distinct labels, sorted; classes[codes] == labels.
+        codes:   Array of the shape of labels with the code of each label.
+    """
+    classes, codes = np.unique(labels, return_inverse=True)
+    return classes, codes.reshape(np.shape(labels))
+
+
+def vote_weights(distances):
+    """Inverse-distance weights of neighbours for weighted voting."""
+    return 1.0 / np.maximum(distances, MIN_VOTE_DISTANCE)
+
+
+def _argmax_ties_high(counts):
+    """Arg max over the last axis, taking the larger code on ties.
+
+    For binary labels this is the rule mean(labels) >= 0.5.
+    """
+    num_classes = counts.shape[-1]
+    return num_classes - 1 - np.argmax(counts[..., ::-1], axis=-1)
+
+
+def vote(neighbour_codes, num_classes, weights=None):
+    """Majority vote over the neighbours of every example.
+
+    The votes of all rows are counted in a single bincount, by offsetting
+    the codes of row i by i * num_classes.
+
+    Inputs:
+        neighbour_codes: The N x k array of label codes of the neighbours.
+        num_classes:     The number of classes C.
+        weights:         Optional N x k array of vote weights.
+
+    Outputs:
+        codes:           The N vector of winning codes; ties go to the
+                         larger code.
+    """
+    num_rows = neighbour_codes.shape[0]
+    offset = neighbour_codes + num_classes * np.arange(num_rows)[:, np.newaxis]
+    counts = np.bincount(
+        offset.ravel(), None if weights is None else weights.ravel(),
+        minlength=num_rows * num_classes)
+    return _argmax_ties_high(counts.reshape(num_rows, num_classes))
+
+
+def run_knn(k, train_data, train_labels, valid_data, weighted=False,
+            num_threads=None):
     """Uses the supplied training inputs and labels to make
     predictions for validation data using the K-nearest neighbours
     algorithm.
@@ -18,23 +190,59 @@ def run_knn(k, train_data, train_labels, valid_data):
                       data.
         train_labels: The N_TRAIN x 1 vector of training labels
                       corresponding to the examples in train_data 
-                      (must be binary).
+                      (any number of classes).
         valid_data:   The N_VALID x M array of data to
                       predict classes for.
+        weighted:     Weight the vote of each neighbour by its inverse
+                      distance instead of counting every vote once.
+        num_threads:  The number of threads, see knn_search.
 
     Outputs:
         valid_labels: The N_VALID x 1 vector of predicted labels 
-                      for the validation data.
+                      for the validation data. Ties go to the larger
+                      label.
     """
 
-    dist = l2_distance(valid_data.T, train_data.T)
-    nearest = np.argsort(dist, axis=1)[:,:k]
+    nearest, distances = knn_search(k, train_data, valid_data,
+                                    num_threads=num_threads)
 
-    train_labels = train_labels.reshape(-1)
-    valid_labels = train_labels[nearest]
-
-    # note this only works for binary labels
-    valid_labels = (np.mean(valid_labels, axis=1) >= 0.5).astype(np.int)
-    valid_labels = valid_labels.reshape(-1,1)
+    classes, train_codes = encode_labels(train_labels.reshape(-1))
+    weights = vote_weights(distances) if weighted else None
+    valid_codes = vote(train_codes[nearest], len(classes), weights)
+    valid_labels = classes[valid_codes].reshape(-1,1)
 
     return valid_labels
+
+
+def run_knn_multi(ks, train_data, train_labels, valid_data, weighted=False,
+                  num_threads=None):
+    """Makes kNN predictions for several values of k from one neighbour
+    search.
+
+    The max(ks) nearest neighbours are found once; a cumulative sum of their
+    one-hot labels along the neighbour axis then gives the vote counts of
+    the first k neighbours for every k at once.
+
+    Inputs:
+        ks:           List of the numbers of neighbours to use.
+        train_data:   The N_TRAIN x M array of training data.
+        train_labels: The N_TRAIN x 1 vector of training labels
+                      (any number of classes).
+        valid_data:   The N_VALID x M array of data to
+                      predict classes for.
+        weighted:     Use distance-weighted votes, see run_knn.
+        num_threads:  The number of threads, see knn_search.
+
+    Outputs:
+        valid_labels: Dictionary from k to the N_VALID x 1 vector of
+                      predicted labels, as run_knn(k, ...) returns them.
+    """
+    nearest, distances = knn_search(max(ks), train_data, valid_data,
+                                    num_threads=num_threads)
+    classes, train_codes = encode_labels(train_labels.reshape(-1))
+    votes = np.eye(len(classes))[train_codes[nearest]]
+    if weighted:
+        votes *= vote_weights(distances)[:, :, np.newaxis]
+    votes = np.cumsum(votes, axis=1)
+    return {k: classes[_argmax_ties_high(votes[:, k - 1])].reshape(-1, 1)
+            for k in ks}
@@ -0,0 +1,154 @@
+"""
+Micro-batching inference server for a trained nn.py model.
+
+Clients submit single 48 x 48 images from any thread. A worker thread
+coalesces the pending requests into one batch, up to max_batch_size images
+and waiting at most max_latency seconds after the first one arrives, and runs
+one forward pass for the whole batch, so BLAS sees matrices instead of single
+rows. Usage:
+
+    with InferenceServer('nn_model.npz') as server:
+        prob = server.predict_proba(image)
+
+You can run this file with the command: "python serve.py" to serve the test
+set of toronto_face.npz from a few client threads.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import threading
+import time
+import numpy as np
+
+from util import LoadData, Load
+from nn import BuildGraph, PredictProba
+from param_store import ComputeDtype
+
+
+class InferenceServer:
+
+    def __init__(self, model, max_batch_size=64, max_latency=0.005):
+        """Serves class probabilities of a network in micro-batches.
+
+        Args:
+            model:          Dictionary of network weights, or the name of a
+                            file saved with Save; it is loaded once.
+            max_batch_size: Largest number of images per forward pass.
+            max_latency:    Longest time in seconds a request waits for
+                            others to join its batch.
+        """
+        if isinstance(model, str):
+            model = Load(model)
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.num_inputs = BuildGraph(model)['layer_sizes'][0]
+        self._inputs = np.empty((max_batch_size, self.num_inputs),
+                                dtype=ComputeDtype(model))
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Starts the worker thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Serves the requests already submitted, then stops the worker."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, image):
+        """Queues one image.
+
+        Args:
+            image:  A 48 x 48 image or a vector of 2304 inputs.
+
+        Returns:
+            future: concurrent.futures.Future of its class probabilities.
+        """
+        if self._thread is None:
+            raise RuntimeError('The server is not running')
+        image = np.asarray(image)
+        if image.size != self.num_inputs:
+            raise ValueError('Expected an image with {} pixels, got {}'.format(
+                self.num_inputs, image.shape))
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def predict_proba(self, image, timeout=None):
+        """Returns the class probabilities of one image (blocking)."""
+        return self.submit(image).result(timeout)
+
+    def predict(self, image, timeout=None):
+        """Returns the class index of one image (blocking)."""
+        return int(np.argmax(self.predict_proba(image, timeout)))
+
+    def _serve(self):
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.perf_counter() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        x = self._inputs[:len(batch)]
+        try:
+            for ii, (image, _) in enumerate(batch):
+                x[ii] = image.reshape(-1)
+            prob = PredictProba(self.model, x)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for ii, (_, future) in enumerate(batch):
+            future.set_result(prob[ii])
+
+
+def main():
+    """Serves the test images one request at a time from client threads."""
+    model_fname = 'nn_model.npz'
+    num_clients = 8
+
+    _, _, inputs_test, _, _, target_test = LoadData('toronto_face.npz')
+    with InferenceServer(model_fname) as server:
+        tic = time.time()
+        with ThreadPoolExecutor(num_clients) as clients:
+            predictions = list(clients.map(server.predict, inputs_test))
+        elapsed = time.time() - tic
+    acc = np.mean(np.array(predictions) == np.argmax(target_test, axis=1))
+    print('Served {} images in {:.3f}s ({:.0f} images/s), Test Acc {:.5f}'.format(
+        len(predictions), elapsed, len(predictions) / elapsed, acc))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+""" Solvers for the logistic regression objectives.
+
+Every solver minimizes an objective with the contract of logistic and
+logistic_pen,
+
+    f, df, y = func(weights, data, targets, hyperparameters)
+
+and stops once the gradient norm falls below tol times a reference norm (or
+1, if larger), instead of running a fixed number of iterations. The
+reference is the gradient norm at the initial weights, so the rule does not
+depend on the scale of the objective, which grows with the number of
+examples for the summed cross entropy. A warm start can pass the reference
+of an earlier cold start as grad_norm0, so that starting close to the
+minimum does not make the tolerance stricter.
+"""
+
+import numpy as np
+
+
+def _objective(func, args):
+    """Wraps func so that it returns f as a float."""
+    def objective(weights):
+        f, df, y = func(weights, *args)
+        return np.asarray(f).item(), df, y
+    return objective
+
+
+def backtracking_line_search(objective, weights, f, df, direction, step=1.0,
+                             shrink=0.5, c=1e-4, max_steps=50):
+    """
+    Find a step along direction with sufficient decrease (Armijo rule).
+
+    Inputs:
+        objective: Function weights -> (f, df, y), f a float.
+        weights:   Current weights.
+        f, df:     Objective and gradient at weights.
+        direction: Descent direction, same shape as weights.
+        step:      Initial step length.
+        shrink:    Factor applied to the step after each rejected step.
+        c:         Fraction of the linear decrease required.
+        max_steps: Maximum number of objective evaluations.
+
+    Outputs:
+        step:      Accepted step length, 0 if none was found.
+        new:       (weights, f, df, y) at the accepted step, or None.
+        num_evals: Number of objective evaluations.
+    """
+    slope = np.sum(df * direction)
+    if slope >= 0:
+        return 0.0, None, 0
+    for num_evals in range(1, max_steps + 1):
+        new_weights = weights + step * direction
+        new_f, new_df, new_y = objective(new_weights)
+        if np.isfinite(new_f) and new_f <= f + c * step * slope:
+            return step, (new_weights, new_f, new_df, new_y), num_evals
+        step *= shrink
+    return 0.0, None, max_steps
+
+
+def _minimize(objective, weights, direction_fn, tol, max_iter,
+              grad_norm0=None):
+    """
+    Run a descent method with backtracking line search.
+
+    direction_fn(weights, f, df, y, it) returns the search direction and the
+    initial step; after every accepted step it is told about the step through
+    direction_fn.update(old, new), if it has that attribute.
+    """
+    f, df, y = objective(weights)
+    if not np.isfinite(f):
+        raise ValueError("nan/inf error")
+    if grad_norm0 is None:
+        grad_norm0 = np.linalg.norm(df)
+    grad_tol = tol * max(1.0, grad_norm0)
+    info = {'num_evaluations': 1, 'converged': False, 'f': [f],
+            'grad_norm0': grad_norm0}
+    it = 0
+    for it in range(max_iter):
+        if np.linalg.norm(df) <= grad_tol:
+            info['converged'] = True
+            break
+        direction, step = direction_fn(weights, f, df, y, it)
+        step, new, num_evals = backtracking_line_search(
+            objective, weights, f, df, direction, step)
+        info['num_evaluations'] += num_evals
+        if new is None:
+            # No decrease along the direction; retry once along -df.
+            step, new, num_evals = backtracking_line_search(
+                objective, weights, f, df, -df,
+                1.0 / max(1.0, np.linalg.norm(df)))
+            info['num_evaluations'] += num_evals
+            if new is None:
+                break
+        if hasattr(direction_fn, 'update'):
+            direction_fn.update((weights, df), (new[0], new[2]))
+        weights, f, df, y = new
+        info['f'].append(f)
+    else:
+        it = max_iter
+        info['converged'] = bool(np.linalg.norm(df) <= grad_tol)
+    info['num_iterations'] = it
+    info['grad_norm'] = np.linalg.norm(df)
+    info['y'] = y
+    return weights, info
+
+
+def gradient_descent(func, weights, args, tol=1e-5, max_iter=1000,
+                     grad_norm0=None):
+    """
+    Minimize func by gradient descent with backtracking line search.
+
+    Each iteration starts its line search from twice the previous step.
+
+    Inputs:
+        func:     Objective with the contract of logistic.
+        weights:  Initial (M+1) x 1 weights.
+        args:     Tuple (data, targets, hyperparameters) passed to func.
+        tol:      Relative gradient norm tolerance.
+        max_iter: Maximum number of iterations.
+        grad_norm0: Reference gradient norm of tol, the one at weights if
+                  None.
+
+    Outputs:
+        weights:  The minimizer found.
+        info:     Dictionary with the objective per iteration 'f', the
+                  predictions 'y' and final 'grad_norm' at the minimizer,
+                  the reference 'grad_norm0', 'num_iterations',
+                  'num_evaluations' and 'converged'.
+    """
+    last_step = [None]
+
+    def direction_fn(weights, f, df, y, it):
+        if last_step[0] is None:
+            return -df, 1.0 / max(1.0, np.linalg.norm(df))
+        return -df, 2 * last_step[0]
+
+    def update(old, new):
+        # The step actually taken, from the change in the weights.
+        last_step[0] = np.linalg.norm(new[0] - old[0]) / \
+            max(np.linalg.norm(old[1]), 1e-300)
+    direction_fn.update = update
+
+    return _minimize(_objective(func, args), weights, direction_fn, tol,
+                     max_iter, grad_norm0)
+
+
+def lbfgs(func, weights, args, tol=1e-5, max_iter=200, memory=10,
+          grad_norm0=None):
+    """
+    Minimize func with L-BFGS and backtracking line search.
+
+    Inputs:
+        func:     Objective with the contract of logistic.
+        weights:  Initial (M+1) x 1 weights.
+        args:     Tuple (data, targets, hyperparameters) passed to func.
+        tol:      Relative gradient norm tolerance.
+        max_iter: Maximum number of iterations.
+        memory:   Number of (step, gradient change) pairs kept.
+        grad_norm0: See gradient_descent.
+
+    Outputs:
+        weights:  The minimizer found.
+        info:     See gradient_descent.
+    """
+    pairs = []
+
+    def direction_fn(weights, f, df, y, it):
+        if not pairs:
+            return -df, 1.0 / max(1.0, np.linalg.norm(df))
+        # Two-loop recursion for H^-1 df.
+        q = df.copy()
+        alphas = []
+        for s, g, rho in reversed(pairs):
+            alpha = rho * np.sum(s * q)
+            q -= alpha * g
+            alphas.append(alpha)
+        s, g, _ = pairs[-1]
+        q *= np.sum(s * g) / np.sum(g * g)
+        for (s, g, rho), alpha in zip(pairs, reversed(alphas)):
+            beta = rho * np.sum(g * q)
+            q += (alpha - beta) * s
+        return -q, 1.0
+
+    def update(old, new):
+        s = new[0] - old[0]
+        g = new[1] - old[1]
+        sg = np.sum(s * g)
+        # Keep the pair only if it carries positive curvature.
+        if sg > 1e-10 * np.sqrt(np.sum(s * s) * np.sum(g * g)):
+            pairs.append((s, g, 1.0 / sg))
+            if len(pairs) > memory:
+                pairs.pop(0)
+    direction_fn.update = update
+
+    return _minimize(_objective(func, args), weights, direction_fn, tol,
+                     max_iter, grad_norm0)
+
+
+def newton_cg(func, hessp, weights, args, tol=1e-5, max_iter=50,
+              max_cg_iter=50, grad_norm0=None):
+    """
+    Minimize func with truncated Newton steps and backtracking line search.
+
+    The Newton system H p = -df is solved approximately by conjugate
+    gradients, which only needs Hessian-vector products, never H itself.
+
+    Inputs:
+        func:        Objective with the contract of logistic.
+        hessp:       Hessian-vector product with the contract of
+                     logistic_hessp, hessp(weights, data, targets,
+                     hyperparameters, y, v).
+        weights:     Initial (M+1) x 1 weights.
+        args:        Tuple (data, targets, hyperparameters) passed to func
+                     and hessp.
+        tol:         Relative gradient norm tolerance.
+        max_iter:    Maximum number of Newton iterations.
+        max_cg_iter: Maximum number of conjugate gradient iterations per
+                     Newton iteration.
+        grad_norm0:  See gradient_descent.
+
+    Outputs:
+        weights:     The minimizer found.
+        info:        See gradient_descent.
+    """
+    def direction_fn(weights, f, df, y, it):
+        grad_norm = np.linalg.norm(df)
+        cg_tol = min(0.5, np.sqrt(grad_norm)) * grad_norm
+        p = np.zeros_like(df)
+        r = -df
+        d = r.copy()
+        rr = np.sum(r * r)
+        for _ in range(max_cg_iter):
+            hd = hessp(weights, *args, y, d)
+            curvature = np.sum(d * hd)
+            if curvature <= 0:
+                # Negative curvature: fall back to the steepest descent
+                # direction if there is no progress yet.
+                if not p.any():
+                    p = -df
+                break
+            alpha = rr / curvature
+            p += alpha * d
+            r -= alpha * hd
+            rr_new = np.sum(r * r)
+            if np.sqrt(rr_new) <= cg_tol:
+                break
+            d *= rr_new / rr
+            d += r
+            rr = rr_new
+        return p, 1.0
+
+    return _minimize(_objective(func, args), weights, direction_fn, tol,
+                     max_iter, grad_norm0)
+
+
+def minimize(func, weights, args, method='lbfgs', hessp=None, **options):
+    """
+    Minimize func with the named solver.
+
+    Inputs:
+        func:     Objective with the contract of logistic.
+        weights:  Initial (M+1) x 1 weights.
+        args:     Tuple (data, targets, hyperparameters) passed to func.
+        method:   'gd', 'lbfgs' or 'newton_cg'.
+        hessp:    Hessian-vector product, required by 'newton_cg'.
+        options:  Keyword arguments of the solver (tol, max_iter,
+                  grad_norm0, ...).
+
+    Outputs:
+        weights:  The minimizer found.
+        info:     See gradient_descent.
+    """
+    if method == 'gd':
+        return gradient_descent(func, weights, args, **options)
+    if method == 'lbfgs':
+        return lbfgs(func, weights, args, **options)
+    if method == 'newton_cg':
+        if hessp is None:
+            raise ValueError("newton_cg needs a Hessian-vector product")
+        return newton_cg(func, hessp, weights, args, **options)
+    raise ValueError("Unknown method {}, expected one of "
+                     "'gd', 'lbfgs', 'newton_cg'".format(method))
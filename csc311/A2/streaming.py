@@ -0,0 +1,190 @@
+""" Streaming minibatch training of logistic regression over data on disk.
+
+The data set is stored as shards of .npy files (see write_shards), which
+are memory-mapped, so only the rows being read are paged in. stream_batches
+reads the shards in turn through a fixed-size shuffle buffer, and
+run_sgd_logistic_regression takes one logistic_pen step per minibatch.
+Memory use is O(buffer_size + batch_size) rows, whatever the size of the
+data set.
+You can run this file with the command: "python streaming.py".
+"""
+
+import glob
+import os
+import numpy as np
+
+from logistic import logistic_pen, logistic_predict, evaluate
+from utils import load_train, load_valid, load_test
+
+
+def write_shards(inputs, targets, dirname, shard_size=10000):
+    """
+    Write a data set as shards of .npy files.
+
+    Inputs:
+        inputs:     N x M data matrix (may itself be a memory map).
+        targets:    N x 1 vector of targets.
+        dirname:    Directory for the shards, created if needed. Shard i is
+                    inputs_<i>.npy and targets_<i>.npy.
+        shard_size: Number of rows per shard.
+    """
+    os.makedirs(dirname, exist_ok=True)
+    for i, start in enumerate(range(0, inputs.shape[0], shard_size)):
+        stop = start + shard_size
+        np.save(os.path.join(dirname, 'inputs_%05d.npy' % i),
+                np.ascontiguousarray(inputs[start:stop]))
+        np.save(os.path.join(dirname, 'targets_%05d.npy' % i),
+                np.ascontiguousarray(targets[start:stop]))
+
+
+def open_shards(dirname):
+    """
+    Memory-map the shards of a data set.
+
+    Outputs:
+        shards: List of (inputs, targets) memory maps, in shard order.
+    """
+    shards = []
+    for fname in sorted(glob.glob(os.path.join(dirname, 'inputs_*.npy'))):
+        suffix = os.path.basename(fname)[len('inputs_'):]
+        shards.append((
+            np.load(fname, mmap_mode='r'),
+            np.load(os.path.join(dirname, 'targets_' + suffix),
+                    mmap_mode='r')))
+    if not shards:
+        raise ValueError("No shards found in {}".format(dirname))
+    return shards
+
+
+def stream_batches(shards, batch_size, buffer_size=10000, shuffle=True,
+                   rng=None):
+    """
+    Yield minibatches from a list of shards.
+
+    With shuffle, the shards are visited in random order and their rows go
+    through a shuffle buffer: once it holds buffer_size rows, every batch is
+    drawn at random positions of the buffer, which are then refilled from
+    the stream. The mixing is only as good as the buffer is large compared
+    to a shard.
+
+    Inputs:
+        shards:      List of (inputs, targets) pairs, see open_shards.
+        batch_size:  Number of rows per batch; batches at the end of a shard
+                     and of the stream may be smaller.
+        buffer_size: Number of rows in the shuffle buffer.
+        shuffle:     Shuffle the rows; otherwise stream them in order.
+        rng:         np.random.RandomState, a fresh one if None.
+
+    Outputs (per batch):
+        inputs:      batch_size x M array.
+        targets:     batch_size x 1 array.
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    order = rng.permutation(len(shards)) if shuffle else range(len(shards))
+
+    def chunks():
+        for s in order:
+            inputs, targets = shards[s]
+            for start in range(0, inputs.shape[0], batch_size):
+                yield (np.asarray(inputs[start:start + batch_size]),
+                       np.asarray(targets[start:start + batch_size]))
+
+    if not shuffle:
+        for chunk in chunks():
+            yield chunk
+        return
+
+    buffer_size = max(buffer_size, batch_size)
+    first_inputs, first_targets = shards[0]
+    buf_inputs = np.empty((buffer_size,) + first_inputs.shape[1:],
+                          first_inputs.dtype)
+    buf_targets = np.empty((buffer_size,) + first_targets.shape[1:],
+                           first_targets.dtype)
+    filled = 0
+    for x, t in chunks():
+        # Top the buffer up first; the rest of the chunk replaces the rows
+        # drawn into the next batch.
+        num_fill = min(buffer_size - filled, x.shape[0])
+        buf_inputs[filled:filled + num_fill] = x[:num_fill]
+        buf_targets[filled:filled + num_fill] = t[:num_fill]
+        filled += num_fill
+        x, t = x[num_fill:], t[num_fill:]
+        if x.shape[0] == 0:
+            continue
+        idx = rng.choice(filled, x.shape[0], replace=False)
+        yield buf_inputs[idx], buf_targets[idx]
+        buf_inputs[idx] = x
+        buf_targets[idx] = t
+
+    idx = rng.permutation(filled)
+    for start in range(0, filled, batch_size):
+        batch = idx[start:start + batch_size]
+        yield buf_inputs[batch], buf_targets[batch]
+
+
+def run_sgd_logistic_regression(shards, lmbda, learning_rate=0.1,
+                                num_passes=10, batch_size=100,
+                                buffer_size=10000, seed=0):
+    """
+    Fit penalized logistic regression by minibatch gradient descent.
+
+    Each step is the update of run_pen_logistic_regression,
+    weights -= learning_rate * df / N, with df / N estimated by the mean
+    over the batch. The penalty is scaled by batch_size / N inside the batch
+    objective, so the steps descend the same objective as logistic_pen on
+    the whole data.
+
+    Inputs:
+        shards:        List of (inputs, targets) pairs, see open_shards.
+        lmbda:         weight_regularization of logistic_pen.
+        learning_rate: Learning rate.
+        num_passes:    Number of passes over the data.
+        batch_size:    Number of rows per step.
+        buffer_size:   Rows in the shuffle buffer, see stream_batches.
+        seed:          Random seed of the weights and the shuffling.
+
+    Outputs:
+        weights:       (M+1) x 1 vector of weights.
+        pass_ce:       num_passes vector, the mean training cross entropy
+                       of the batches of every pass.
+    """
+    rng = np.random.RandomState(seed)
+    N = sum(inputs.shape[0] for inputs, _ in shards)
+    M = shards[0][0].shape[1]
+    weights = rng.rand(M + 1, 1) / 10
+    pass_ce = np.zeros(num_passes)
+    for p in range(num_passes):
+        for inputs, targets in stream_batches(shards, batch_size, buffer_size,
+                                              rng=rng):
+            n = inputs.shape[0]
+            hyperparameters = {'weight_regularization': lmbda * n / N}
+            f, df, _ = logistic_pen(weights, inputs, targets, hyperparameters)
+            pass_ce[p] += f.item() - hyperparameters['weight_regularization'] \
+                / 2 * np.sum(weights ** 2)
+            weights = weights - learning_rate * df / n
+        pass_ce[p] /= N
+    return weights, pass_ce
+
+
+def main():
+    """Streams the MNIST training set from shards on disk."""
+    dirname = 'mnist_train_shards'
+    lmbda = 0.001
+
+    train_inputs, train_targets = load_train()
+    write_shards(train_inputs, train_targets, dirname, shard_size=50)
+    weights, pass_ce = run_sgd_logistic_regression(
+        open_shards(dirname), lmbda, num_passes=20, batch_size=10,
+        buffer_size=100)
+    print("TRAIN CE per pass:", pass_ce)
+
+    for name, (inputs, targets) in [('VALID', load_valid()),
+                                    ('TEST', load_test())]:
+        ce, frac_correct = evaluate(targets, logistic_predict(weights, inputs))
+        print("{} CE:{}  {} FRAC:{}".format(name, ce[0][0], name,
+                                             frac_correct * 100))
+
+
+if __name__ == '__main__':
+    main()
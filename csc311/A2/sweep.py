@@ -0,0 +1,248 @@
+"""
+Hyperparameter sweeps for the MLP in nn.py.
+
+The data set is loaded once by the parent process and placed in shared
+memory; a pool of worker processes attaches to it and runs one InitNN + Train
+per configuration, with the BLAS thread count of every worker pinned so the
+workers do not oversubscribe the cores. One row of results per run is written
+to a CSV table; a run that raises is recorded with its error instead of
+ending the sweep.
+You can run this file with the command: "python sweep.py".
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from util import LoadData
+from nn import InitNN, NNForward, NNBackward, NNUpdate, Train
+from metrics import MemorySink
+
+# Environment variables read by the common BLAS builds at startup.
+BLAS_THREAD_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                    'NUMEXPR_NUM_THREADS']
+
+# Defaults for the keys a configuration may leave out.
+DEFAULT_CONFIG = {
+    'num_hiddens': [16, 32],
+    'activation': 'relu',
+    'eps': 0.01,
+    'momentum': 0.9,
+    'num_epochs': 100,
+    'batch_size': 100,
+    'seed': 0
+}
+
+# Shared data of a worker process, set by _InitWorker.
+_DATA = None
+_BLOCKS = None
+
+
+def GridSearch(space):
+    """Lists every combination of a grid.
+
+    Args:
+        space:   Dictionary from hyperparameter name to a list of values.
+
+    Returns:
+        configs: List of dictionaries, one per combination.
+    """
+    names = sorted(space)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[space[k] for k in names])]
+
+
+def RandomSearch(space, num_samples, seed=0):
+    """Draws random configurations.
+
+    Args:
+        space:       Dictionary from hyperparameter name to either a list of
+                     values to choose from, a (low, high) tuple to sample
+                     uniformly, or a (low, high, 'log') tuple to sample
+                     log-uniformly.
+        num_samples: Number of configurations to draw.
+        seed:        Random seed.
+
+    Returns:
+        configs:     List of dictionaries.
+    """
+    rng = np.random.RandomState(seed)
+    configs = []
+    for _ in range(num_samples):
+        config = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values, list):
+                config[name] = values[rng.randint(len(values))]
+            elif len(values) == 3 and values[2] == 'log':
+                config[name] = float(np.exp(rng.uniform(
+                    np.log(values[0]), np.log(values[1]))))
+            else:
+                config[name] = float(rng.uniform(values[0], values[1]))
+        configs.append(config)
+    return configs
+
+
+def _ShareArrays(arrays):
+    """Copies arrays into new shared memory blocks.
+
+    Returns:
+        blocks: The SharedMemory objects, to be closed and unlinked by the
+                caller.
+        specs:  Picklable (name, shape, dtype) triples to attach with.
+    """
+    blocks = []
+    specs = []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs.append((block.name, array.shape, array.dtype.str))
+    return blocks, specs
+
+
+def _InitWorker(specs):
+    """Attaches a worker process to the shared data set."""
+    global _DATA, _BLOCKS
+    _BLOCKS = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    _DATA = tuple(np.ndarray(shape, dtype, buffer=block.buf)
+                  for block, (_, shape, dtype) in zip(_BLOCKS, specs))
+
+
+def RunConfig(config, data):
+    """Trains one network and summarizes the run.
+
+    Args:
+        config: Hyperparameters, missing keys are taken from DEFAULT_CONFIG.
+        data:   Tuple of arrays as returned by LoadData.
+
+    Returns:
+        row:    The full configuration plus the final train, validation and
+                test cross entropy and accuracy, the best validation accuracy
+                and the wall time of the run.
+    """
+    config = dict(DEFAULT_CONFIG, **config)
+    np.random.seed(config['seed'])
+    model = InitNN(data[0].shape[1], config['num_hiddens'], data[3].shape[1],
+                   activation=config['activation'])
+    sink = MemorySink()
+    tic = time.time()
+    Train(model, NNForward, NNBackward, NNUpdate, config['eps'],
+          config['momentum'], int(config['num_epochs']),
+          int(config['batch_size']), sinks=[sink], data=data)
+    row = dict(config)
+    for key in ['train_ce', 'valid_ce', 'test_ce',
+                'train_acc', 'valid_acc', 'test_acc']:
+        row[key] = float(sink.get('final', key)[-1])
+    row['best_valid_acc'] = float(sink.get('epoch', 'valid_acc').max())
+    row['time'] = time.time() - tic
+    return row
+
+
+def _RunConfig(config):
+    """Runs RunConfig in a worker, returning a failed run as an error row."""
+    try:
+        return RunConfig(config, _DATA)
+    except Exception as e:
+        row = dict(DEFAULT_CONFIG, **config)
+        row['error'] = '{}: {}'.format(type(e).__name__, e)
+        return row
+
+
+def _WriteRows(fname, rows):
+    """Writes result rows to a CSV table, the union of their keys as columns.
+    """
+    fieldnames = sorted(set().union(*rows)) if rows else []
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Writing to ' + fname)
+
+
+def RunSweep(configs, num_workers=None, blas_threads=1,
+             results_fname='sweep_results.csv', data_fname='toronto_face.npz'):
+    """Runs a sweep over a process pool.
+
+    Args:
+        configs:       List of hyperparameter dictionaries, see RunConfig.
+        num_workers:   Number of worker processes, defaults to the number of
+                       cores divided by blas_threads.
+        blas_threads:  BLAS threads per worker.
+        results_fname: CSV file for the results table, None to skip it. It
+                       is written even if the sweep is interrupted, with the
+                       runs completed so far.
+        data_fname:    Data set to load.
+
+    Returns:
+        rows:          One result row per configuration, in order. A run
+                       that raised has its configuration and an 'error'
+                       entry instead of results.
+    """
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1) // blas_threads)
+    blocks, specs = _ShareArrays(LoadData(data_fname))
+
+    # The workers are spawned fresh, so they read the thread limits when
+    # their BLAS starts up.
+    saved_env = {k: os.environ.get(k) for k in BLAS_THREAD_VARS}
+    os.environ.update({k: str(blas_threads) for k in BLAS_THREAD_VARS})
+    try:
+        pool = multiprocessing.get_context('spawn').Pool(
+            num_workers, initializer=_InitWorker, initargs=(specs,))
+    finally:
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    rows = []
+    try:
+        for ii, row in enumerate(pool.imap(_RunConfig, configs)):
+            if 'error' in row:
+                print('Run {:3d}/{:d} Failed {} {}'.format(
+                    ii + 1, len(configs), row['error'], configs[ii]))
+            else:
+                print('Run {:3d}/{:d} Valid Acc {:.5f} Time {:.1f}s {}'.format(
+                    ii + 1, len(configs), row['valid_acc'], row['time'],
+                    configs[ii]))
+            rows.append(row)
+    except BaseException:
+        # Do not wait for the remaining runs (e.g. on KeyboardInterrupt).
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+        for block in blocks:
+            block.close()
+            block.unlink()
+        if results_fname is not None:
+            _WriteRows(results_fname, rows)
+    return rows
+
+
+def main():
+    """Runs a grid sweep."""
+    space = {
+        'num_hiddens': [[16, 32], [32, 64], [64, 64]],
+        'eps': [0.001, 0.01, 0.1],
+        'momentum': [0.0, 0.5, 0.9],
+        'batch_size': [50, 100, 500]
+    }
+    RunSweep(GridSearch(space))
+
+
+if __name__ == '__main__':
+    main()
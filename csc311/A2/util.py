@@ -1,49 +1,139 @@
 from __future__ import division
 from __future__ import print_function
 
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-plt.ion()
 
-def LoadData(fname):
-    """ Loads data """
+# Splits of a data set file, in the order LoadData returns them.
+SPLITS = ['train', 'valid', 'test']
 
+
+def CacheDir(fname):
+    """Returns the directory holding the .npy cache of a data set file."""
+    return os.path.splitext(fname)[0] + '_cache'
+
+
+def _CacheFiles(cache_dir, dtype):
+    """Maps the array names of a cache to their .npy files."""
+    files = {}
+    for split in SPLITS:
+        files['inputs_' + split] = os.path.join(
+            cache_dir, 'inputs_%s_%s.npy' % (split, np.dtype(dtype).name))
+        files['target_' + split] = os.path.join(
+            cache_dir, 'target_%s.npy' % split)
+    return files
+
+
+def _ReadData(fname, dtype):
+    """Reads the arrays of a data set file into memory."""
     npzfile = np.load(fname)
-    
-    inputs_train = npzfile['inputs_train'].T / 255.0
-    inputs_valid = npzfile['inputs_valid'].T / 255.0
-    inputs_test = npzfile['inputs_test'].T / 255.0
-    target_train = npzfile['target_train'].tolist()
-    target_valid = npzfile['target_valid'].tolist()
-    target_test = npzfile['target_test'].tolist()
+    arrays = {}
+    for split in SPLITS:
+        inputs = npzfile['inputs_' + split].astype(dtype)
+        inputs /= 255.0
+        arrays['inputs_' + split] = inputs
+        arrays['target_' + split] = np.asarray(
+            npzfile['target_' + split], dtype=np.int64).reshape(-1)
+    return arrays
+
 
-    num_class = max(target_train + target_valid + target_test) + 1
-    target_train_1hot = np.zeros([num_class, len(target_train)])
-    target_valid_1hot = np.zeros([num_class, len(target_valid)])
-    target_test_1hot = np.zeros([num_class, len(target_test)])
+def BuildCache(fname, cache_dir=None, dtype=np.float64):
+    """Converts a data set file into a cache of raw .npy files.
 
-    for ii, xx in enumerate(target_train):
-        target_train_1hot[xx, ii] = 1.0
+    Each split is stored as inputs_<split>_<dtype>.npy, the pixels scaled to
+    [0, 1] as a C-contiguous array of the given dtype (the same values as
+    reading fname directly), and target_<split>.npy, the class labels as
+    int64, so that LoadData can memory-map them instead of decompressing and
+    converting the file on every run.
+
+    Args:
+        fname:     Name of the .npz data set file.
+        cache_dir: Directory to write to, CacheDir(fname) by default.
+        dtype:     Floating point type of the cached inputs.
+
+    Returns:
+        cache_dir: The cache directory.
+    """
+    if cache_dir is None:
+        cache_dir = CacheDir(fname)
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = _ReadData(fname, dtype)
+    for name, path in _CacheFiles(cache_dir, dtype).items():
+        # Written under a temporary name first, so that an interrupted
+        # conversion never leaves a truncated array behind.
+        np.save(path + '.tmp.npy', np.ascontiguousarray(arrays[name]))
+        os.replace(path + '.tmp.npy', path)
+    return cache_dir
+
+
+def _CacheIsFresh(fname, cache_dir, dtype):
+    """Whether every cache file exists and is newer than the data set file.
+
+    Without the data set file, an existing cache is all there is, so it
+    counts as fresh.
+    """
+    mtime = os.path.getmtime(fname) if os.path.exists(fname) else -np.inf
+    for path in _CacheFiles(cache_dir, dtype).values():
+        if not os.path.exists(path) or os.path.getmtime(path) < mtime:
+            return False
+    return True
 
-    for ii, xx in enumerate(target_valid):
-        target_valid_1hot[xx, ii] = 1.0
 
-    for ii, xx in enumerate(target_test):
-        target_test_1hot[xx, ii] = 1.0
+def OneHot(labels, num_class, dtype=np.float64):
+    """Returns the 1-of-K encoding of integer labels, an N x num_class array."""
+    return np.eye(num_class, dtype=dtype)[labels]
 
-    inputs_train = inputs_train.T
-    inputs_valid = inputs_valid.T
-    inputs_test = inputs_test.T
-    target_train_1hot = target_train_1hot.T
-    target_valid_1hot = target_valid_1hot.T
-    target_test_1hot = target_test_1hot.T
-    return inputs_train, inputs_valid, inputs_test, target_train_1hot, target_valid_1hot, target_test_1hot 
+
+def LoadData(fname, dtype=np.float64, cache=True, cache_dir=None):
+    """ Loads data, as arrays of the given floating point type.
+
+    The first call for a dtype converts fname into a cache of .npy files
+    (see BuildCache) and later calls memory-map it: the inputs are returned
+    as read-only memory maps, whose pages are read from disk only when
+    touched, and hold the same values as reading fname directly. If the
+    cache cannot be written (e.g. a read-only directory), fname is read into
+    memory instead.
+
+    Args:
+        fname:     Name of the .npz data set file.
+        dtype:     Floating point type of the returned arrays.
+        cache:     Use (and create if needed) the .npy cache; False reads
+                   fname directly.
+        cache_dir: Directory of the cache, CacheDir(fname) by default.
+    """
+    arrays = None
+    if cache:
+        if cache_dir is None:
+            cache_dir = CacheDir(fname)
+        try:
+            if not _CacheIsFresh(fname, cache_dir, dtype):
+                BuildCache(fname, cache_dir, dtype)
+        except OSError:
+            if not os.path.exists(fname):
+                raise
+        else:
+            arrays = {name: np.load(path, mmap_mode='r') for name, path in
+                      _CacheFiles(cache_dir, dtype).items()}
+    if arrays is None:
+        arrays = _ReadData(fname, dtype)
+
+    inputs = [arrays['inputs_' + split] for split in SPLITS]
+    labels = [arrays['target_' + split] for split in SPLITS]
+    num_class = max(int(l.max()) for l in labels if l.size) + 1
+    targets = [OneHot(l, num_class, dtype) for l in labels]
+    return tuple(inputs) + tuple(targets)
 
 
 def Save(fname, data):
-    """Saves the model to a numpy file."""
+    """Saves the model to a numpy file.
+
+    Keys starting with an underscore hold runtime state (such as the
+    parameter store buffer) and are skipped.
+    """
     print('Writing to ' + fname)
-    np.savez_compressed(fname, **data)
+    np.savez_compressed(fname, **{k: v for k, v in data.items()
+                                  if not k.startswith('_')})
 
 
 def Load(fname):
@@ -71,9 +161,3 @@ def DisplayPlot(train, valid, ylabel, number=0):
     plt.legend()
     plt.draw()
     plt.pause(0.0001)    
-
-
-inputs_train, inputs_valid, inputs_test, target_train_1hot, \
-target_valid_1hot, target_test_1hot = LoadData('toronto_face.npz')
-print(target_train_1hot)
-
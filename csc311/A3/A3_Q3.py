@@ -1,6 +1,14 @@
 from utils import *
+import os
+import sys
 import matplotlib.pyplot as plt
 
+# The kNN search is shared with A2. Appended, so that utils above still
+# resolves to this directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'A2'))
+from run_knn import knn_search
+
 
 def project_to_train(k, inputs_data, inputs_train_data):
 
@@ -19,21 +27,8 @@ def project_to_train(k, inputs_data, inputs_train_data):
     return projection_input, projection_train
 
 
-def l2_distance(a, b):
-
-    if a.shape[0] != b.shape[0]:
-        raise ValueError("A and B should be of same dimensionality")
-
-    aa = np.sum(a**2, axis=0)
-    bb = np.sum(b**2, axis=0)
-    ab = np.dot(a.T, b)
-
-    return np.sqrt(aa[:, np.newaxis] + bb[np.newaxis, :] - 2*ab)
-
-
 def run_1nn(train_data, train_labels, valid_data):
-    dist = l2_distance(valid_data.T, train_data.T)
-    nearest = np.argsort(dist, axis=1)[:, :1]
+    nearest, _ = knn_search(1, train_data, valid_data)
 
     train_labels = train_labels.reshape(-1)
     valid_labels = train_labels[nearest]